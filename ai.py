@@ -1,83 +1,604 @@
 import random
-import chess
-import chess.polyglot
 import time
+import atexit
+import multiprocessing
+import queue
+import threading
+from array import array
+from multiprocessing import shared_memory
+import chess_engine
+import evaluation
+import game_log
+import nnue
+import transposition
+import move_ordering
+import polyglot_book
+from move_encoding import PROMOTION, ENPASSANT, end_square, flag
 
+# piece values in pawns (score_material and move ordering), the search itself scores in centipawns (see evaluation)
 piece_scores = {"K": 0, "Q": 10, "R": 5, "N": 3, "B": 3, "P": 1}
-CHECKMATE = 1000
-STALEMATEZ = 0
+CHECKMATE = 100000
+STALEMATE = 0
 
-def find_random_move(valid_moves, gs, board):
+# scores above this are mates, counted in plies from the root
+MATE_BOUND = CHECKMATE - 1000
 
-    opening_move = 0
-    weight = 0
+# default budget for find_better_move (the search stops at whichever limit it hits first)
+MAX_DEPTH = 64
+TIME_LIMIT = 1.0 # seconds
+PONDER_TIME_LIMIT = 4 * TIME_LIMIT # cap on a ponder search, so a long think by the opponent doesn't hold a core busy
 
-    # if gs.white_to_move:
-    # with chess.polyglot.open_reader("opening_book/poly17/books/Perfect2017-SF12.bin") as reader:
-    #     for entry in reader.find_all(board):
-    #         if entry.weight > weight:
-    #             opening_move = str(entry.move)
-    #             weight = entry.weight
-    #         print(entry.move, entry.weight)
+# how often (in nodes) the clock is read
+CHECK_EVERY = 256
 
-    with chess.polyglot.open_reader("opening_book/pwned.polyglot.bin") as reader:
-        for entry in reader.find_all(board):
-            if entry.weight > weight:
-                opening_move = str(entry.move)
-                weight = entry.weight
-            print(entry.move, entry.weight)
+# quiescence delta pruning margin, a capture must be able to lift the score this close to alpha to be searched
+DELTA_MARGIN = 200
 
-    for move in valid_moves:
+# shared transposition table, sized in MB (read hash_table.stats() after a search for hit/miss/collision counts,
+# or parallel.stats() after a parallel search, whose workers probe their own views of a shared table)
+HASH_MB = 16
+hash_table = transposition.transposition_table(HASH_MB)
+hash_settings = (HASH_MB, "depth")
+
+# searches use this many threads, more than one runs a lazy smp search in worker processes (see parallel_search)
+THREADS = 1
+parallel = None # running parallel_searcher, started on first use
+
+# resize the table (or switch replacement scheme), this drops everything stored so far
+def set_hash_size(size_mb, replacement = "depth"):
+    global hash_table, hash_settings
+    hash_table = transposition.transposition_table(size_mb, replacement)
+    hash_settings = (size_mb, replacement)
+    close_parallel()
+
+def set_threads(threads):
+    global THREADS
+    THREADS = max(1, int(threads))
+    close_parallel()
 
-        if move.get_chess_notation() == opening_move:
-            
-            print("Book Used")
-            print("Move Made: " + move.get_chess_notation())
+# book move if the position is in the merged books, otherwise a random one
+def find_random_move(valid_moves, gs):
 
-            # update ascii board
-            move_played_string = move.get_chess_notation()
-            board.push(chess.Move.from_uci(move_played_string))
-            print(board)
-            print("--------------------------------------------------------------------------------")
+    # the merged books are loaded once and probed by the position's zobrist key
+    try:
+        book_move = polyglot_book.open_merged().probe(gs)
+    except (OSError, ValueError):
+        book_move = None
+
+    for move in valid_moves:
+        if book_move is not None and move.packed == book_move:
+            game_log.logger.info("book move: %s", move.get_chess_notation())
             return move
 
     move_made = valid_moves[random.randint(0, len(valid_moves) - 1)]
-    move_played_string = move_made.get_chess_notation()
-    board.push(chess.Move.from_uci(move_played_string))
-    print("Random Move")
-    print("Move Made: " + move_played_string)
-    print(board)
-    print("--------------------------------------------------------------------------------")
+    game_log.logger.info("random move: %s", move_made.get_chess_notation())
     return move_made
 
+# live statistics for a search, another thread may set stopped to end it early
+class search_info():
+
+    # constructor
+    def __init__(self):
+        self.nodes = 0
+        self.depth = 0 # last fully searched depth
+        self.score = 0
+        self.best_move = None
+        self.pv = []
+        self.stopped = False
+        self.start_time = time.time()
+        self.deadline = None
+        self.max_nodes = None
+        self.hit_limit = None # (time limit, time it counts from or None for the search's start) after a ponder hit
+        self.on_iteration = None # optional callback, called with this object after each completed depth
+        self.stop_event = None # optional multiprocessing event, for stopping a search from another process
+        self.ordering = move_ordering.move_ordering(piece_scores) # killer and history tables for this search
+
+        # one reusable packed move buffer per ply, so generating moves doesn't build new lists
+        self.buffers = [array("H") for i in range(move_ordering.MAX_PLY)]
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def nps(self):
+        elapsed = self.elapsed()
+        return int(self.nodes / elapsed) if elapsed > 0 else 0
+
+    # empty move buffer for a ply (a fresh list past the preallocated depth)
+    def move_buffer(self, ply):
+        if ply >= len(self.buffers):
+            return []
+        buffer = self.buffers[ply]
+        del buffer[:]
+        return buffer
+
+    # the ponder move was played, stop time_limit seconds from now (or from the search's start, with from_start)
+    # the limit is kept as well as applied, so a search that hasn't started yet still takes it (see apply_hit)
+    def ponder_hit(self, time_limit, from_start = False):
+        self.hit_limit = (time_limit, None if from_start else time.time())
+        self.apply_hit()
+
+    # set the deadline from a ponder hit, if there was one
+    def apply_hit(self):
+        hit_limit = self.hit_limit
+        if hit_limit is not None:
+            time_limit, since = hit_limit
+            self.deadline = (self.start_time if since is None else since) + time_limit
+
+    # read the clock and node count, flag the search as stopped once either runs out
+    def check_limits(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.stopped = True
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.stopped = True
+        if self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+
+# mate scores are stored relative to the node so they stay valid when reached at a different ply
+def score_to_tt(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+# evaluation used by the search, piece-square tables (evaluation.evaluate) unless set_evaluator picks nnue
+evaluator = evaluation.evaluate
+evaluator_settings = ("pst", None) # (name, network path), handed on to the lazy smp workers
+
+# switch the search's evaluation, name is "pst" or "nnue" (network_path defaults to nnue.NETWORK_PATH)
+# running lazy smp workers are restarted so they pick it up too
+def set_evaluator(name = "pst", network_path = None):
+    global evaluator, evaluator_settings
+    if name == "pst":
+        evaluator = evaluation.evaluate
+    elif name == "nnue":
+        evaluator = nnue.nnue_network(network_path or nnue.NETWORK_PATH).evaluate
+    else:
+        raise ValueError("unknown evaluator: " + str(name))
+    if evaluator_settings != (name, network_path):
+        evaluator_settings = (name, network_path)
+        close_parallel()
+
+# static evaluation from the side to move's point of view (incremental, set evaluation.DEBUG to cross-check it)
+def evaluate(gs):
+    return evaluator(gs)
+
+# iterative deepening negamax with alpha-beta, limited by depth, wall clock time (seconds) and/or nodes
+# returns (best move, score for the side to move, principal variation) from the deepest completed depth
+# (moves come back as chess_engine.move objects, the search itself works on packed moves)
+# start_depth lets lazy smp helpers begin deeper than the main search
+def search(gs, max_depth = MAX_DEPTH, time_limit = None, max_nodes = None, info = None, root_moves = None, start_depth = 1):
+
+    if info is None:
+        info = search_info()
+    info.start_time = time.time()
+    info.deadline = info.start_time + time_limit if time_limit is not None else None
+    info.max_nodes = max_nodes
+    info.apply_hit() # a ponder hit that came in before the search started
+
+    if root_moves is None:
+        root_moves = gs.valid_moves_packed()
+    else:
+        root_moves = [player_move.packed for player_move in root_moves]
+    if len(root_moves) == 0:
+        return None, -CHECKMATE if gs.in_check else STALEMATE, []
+
+    # always have a move to play, even if the first iteration can't finish
+    info.best_move = chess_engine.move_from_packed(root_moves[0], gs.board)
+    hash_table.new_search()
+    hash_table.reset_stats()
+
+    for depth in range(min(start_depth, max_depth), max_depth + 1):
+        pv = []
+        score = negamax(gs, depth, -CHECKMATE - 1, CHECKMATE + 1, 0, info, pv, root_moves)
+
+        # an interrupted iteration can't be trusted, keep the last complete one
+        if info.stopped:
+            break
+
+        info.depth = depth
+        info.score = score
+        info.pv = to_moves(gs, extend_pv(gs, pv, depth))
+        info.best_move = info.pv[0]
+
+        if info.on_iteration is not None:
+            info.on_iteration(info)
+
+        # found a forced mate, deeper won't change it
+        if abs(score) > MATE_BOUND:
+            break
+
+        info.check_limits()
+        if info.stopped:
+            break
+
+    return info.best_move, info.score, info.pv
+
+# turn a line of packed moves into move objects (each read off the board it's played on)
+def to_moves(gs, line):
+    moves = []
+    for m in line:
+        moves.append(chess_engine.move_from_packed(m, gs.board))
+        gs.make_packed(m)
+    for m in line:
+        gs.undo_packed()
+    return moves
+
+# table cutoffs can cut the pv short, so follow the stored best moves to fill it out to depth
+def extend_pv(gs, pv, depth):
+
+    pv = list(pv)
+    for m in pv:
+        gs.make_packed(m)
+
+    while len(pv) < depth:
+        entry = hash_table.probe(gs.zobrist_key)
+        if entry is None or not entry[0] or entry[0] not in gs.valid_moves_packed():
+            break
+        gs.make_packed(entry[0])
+        pv.append(entry[0])
+
+    for m in pv:
+        gs.undo_packed()
+
+    return pv
+
+def negamax(gs, depth, alpha, beta, ply, info, pv, moves = None):
+
+    info.nodes += 1
+    if info.nodes % CHECK_EVERY == 0:
+        info.check_limits()
+    if info.stopped:
+        return 0
+
+    # transposition table cutoff (never at the root, it needs a real move and pv)
+    alpha_start = alpha
+    tt_move = 0
+    entry = hash_table.probe(gs.zobrist_key)
+    if entry is not None:
+        tt_move, tt_score, tt_depth, tt_bound = entry
+        if ply > 0 and tt_depth >= depth:
+            tt_score = score_from_tt(tt_score, ply)
+            if tt_bound == transposition.EXACT or \
+                (tt_bound == transposition.LOWER and tt_score >= beta) or \
+                (tt_bound == transposition.UPPER and tt_score <= alpha):
+                return tt_score
+
+    # horizon, settle the captures before evaluating
+    if depth <= 0:
+        return quiescence(gs, alpha, beta, ply, info)
+
+    if moves is None:
+        moves = gs.valid_moves_packed(info.move_buffer(ply))
+
+    # checkmate or stalemate
+    if len(moves) == 0:
+        return -CHECKMATE + ply if gs.in_check else STALEMATE
+
+    best_score = -CHECKMATE - 1
+    best_move = 0
+    child_pv = []
+
+    for m in info.ordering.pick(gs.board, moves, tt_move, ply):
+        gs.make_packed(m)
+        child_pv.clear()
+        score = -negamax(gs, depth - 1, -beta, -alpha, ply + 1, info, child_pv)
+        gs.undo_packed()
+
+        if info.stopped:
+            return 0
+
+        if score > best_score:
+            best_score = score
+            best_move = m
+
+            if score > alpha:
+                alpha = score
+                pv[:] = [m] + child_pv
+
+                if alpha >= beta:
+                    info.ordering.cutoff(gs.board, m, depth, ply)
+                    break
+
+    if best_score >= beta:
+        bound = transposition.LOWER
+    elif best_score > alpha_start:
+        bound = transposition.EXACT
+    else:
+        bound = transposition.UPPER
+    hash_table.store(gs.zobrist_key, best_move, score_to_tt(best_score, ply), depth, bound)
+
+    return best_score
+
+# capture-only search at the leaves so the evaluation isn't taken in the middle of an exchange
+def quiescence(gs, alpha, beta, ply, info):
+
+    info.nodes += 1
+    if info.nodes % CHECK_EVERY == 0:
+        info.check_limits()
+    if info.stopped:
+        return 0
+
+    moves = gs.valid_moves_packed(info.move_buffer(ply), captures_only = True)
+
+    # in check every evasion has to be considered, and standing pat isn't an option
+    if gs.in_check:
+        moves = gs.valid_moves_packed(info.move_buffer(ply))
+        if len(moves) == 0:
+            return -CHECKMATE + ply
+        stand_pat = None
+        best_score = -CHECKMATE - 1
+    else:
+        stand_pat = evaluate(gs)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        best_score = stand_pat
+
+    board = gs.board
+    for m in info.ordering.pick(board, moves, 0, ply):
+
+        # delta pruning, skip captures that can't raise alpha even after winning the piece
+        if stand_pat is not None:
+            move_flag = flag(m)
+            if move_flag == ENPASSANT:
+                gain = evaluation.MG_VALUES["P"]
+            elif move_flag != PROMOTION:
+                end = end_square(m)
+                gain = evaluation.MG_VALUES[board[end >> 3][end & 7][1]]
+            else:
+                gain = None
+            if gain is not None and stand_pat + gain + DELTA_MARGIN <= alpha:
+                continue
+
+        gs.make_packed(m)
+        score = -quiescence(gs, -beta, -alpha, ply + 1, info)
+        gs.undo_packed()
+
+        if info.stopped:
+            return 0
+
+        if score > best_score:
+            best_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+
+    return best_score
+
+# pick a move for the ai player within the default budget
 def find_better_move(valid_moves, gs):
-    
-    turn = 1 if gs.white_to_move else -1
-
-    max_score = -CHECKMATE
-    best_move = None
-
-    for player_move in valid_moves:
-        gs.make_move(player_move)
-        
-        
-        # add in checkmate and stalemate if conditions
-        '''
-        if gs.checkmate:
-            score = CHECKMATE
-        elif gs.stalemate:
-            score = STALEMATE
+    if THREADS > 1:
+        return parallel_search(gs, time_limit = TIME_LIMIT, root_moves = valid_moves)[0]
+    return search(gs, time_limit = TIME_LIMIT, root_moves = valid_moves)[0]
+
+# a search running on its own thread over a copy of the position, so the caller's loop (the pygame window) keeps going
+# poll done() each frame and read result once it is, info has the live depth and nodes, stop() cancels it
+# with a ponder_move it searches the position after that move for up to PONDER_TIME_LIMIT (pondering on the opponent's
+# time, filling the transposition table), until ponder_hit() says the opponent played it and starts the clock
+class background_search():
+
+    # constructor (starts the search right away)
+    def __init__(self, gs, time_limit = TIME_LIMIT, max_depth = MAX_DEPTH, max_nodes = None, ponder_move = None):
+        self.info = search_info()
+        self.result = None # (best move, score, pv) once the search is done
+        self.position = chess_engine.game_state("bitboard", fen = gs.get_fen())
+        self.time_limit = time_limit
+        self.ponder_move = ponder_move
+        if ponder_move is not None:
+            self.position.make_packed(ponder_move)
+            time_limit = PONDER_TIME_LIMIT
+        self.thread = threading.Thread(target = self.run, args = (max_depth, time_limit, max_nodes), daemon = True)
+        self.thread.start()
+
+    def run(self, max_depth, time_limit, max_nodes):
+        if THREADS > 1:
+            self.result = parallel_search(self.position, max_depth, time_limit, max_nodes, self.info)
+        else:
+            self.result = search(self.position, max_depth, time_limit, max_nodes, self.info)
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    # the best move found as a packed move, or None (no legal moves, or not done yet)
+    def best_move(self):
+        if self.result is None or self.result[0] is None:
+            return None
+        return self.result[0].packed
+
+    # the opponent played the ponder move, the search carries on as a normal one whose time counts from when
+    # pondering began (so a long ponder answers at once with what it has)
+    def ponder_hit(self):
+        self.ponder_move = None
+        if self.time_limit is not None:
+            self.info.ponder_hit(self.time_limit, from_start = True)
+
+    # end the search early and wait for the thread
+    def stop(self):
+        self.info.stopped = True
+        self.thread.join()
+
+# lazy smp: THREADS worker processes search the same position at once, sharing one transposition table in
+# shared memory, so each worker finds the others' results in the table and skips work they've already done
+# odd workers start a depth ahead so they aren't all searching the same tree, the deepest completed result wins
+# takes and returns the same as search (the workers are kept running between searches)
+def parallel_search(gs, max_depth = MAX_DEPTH, time_limit = None, max_nodes = None, info = None, root_moves = None):
+    global parallel
+    if parallel is None or len(parallel.workers) != THREADS:
+        close_parallel()
+        parallel = parallel_searcher(THREADS, *hash_settings, *evaluator_settings)
+    return parallel.search(gs, max_depth, time_limit, max_nodes, info, root_moves)
+
+def close_parallel():
+    global parallel
+    if parallel is not None:
+        parallel.close()
+        parallel = None
+
+atexit.register(close_parallel)
+
+# worker processes for parallel_search
+class parallel_searcher():
+
+    # constructor (starts the workers, the table lives in shared memory owned by this process,
+    # every worker searches with the evaluator named, see set_evaluator)
+    def __init__(self, threads, size_mb = HASH_MB, replacement = "depth", evaluator_name = "pst", network_path = None):
+
+        # spawn rather than fork, the parent may be running pygame
+        context = multiprocessing.get_context("spawn")
+
+        self.memory = shared_memory.SharedMemory(create = True, size = transposition.table_bytes(size_mb))
+        self.stop_event = context.Event()
+        self.results = context.Queue()
+        self.jobs = [context.Queue() for i in range(threads)]
+        self.search_id = 0
+        self.table_stats = {}
+
+        self.workers = []
+        for worker_id in range(threads):
+            worker = context.Process(target = parallel_worker, daemon = True,
+                                     args = (worker_id, self.memory.name, size_mb, replacement, evaluator_name,
+                                             network_path, self.jobs[worker_id], self.results, self.stop_event))
+            worker.start()
+            self.workers.append(worker)
+
+    # end a running search early (from another thread)
+    def stop(self):
+        self.stop_event.set()
+
+    # transposition table counts of the last search, summed over the workers
+    def stats(self):
+        return dict(self.table_stats)
+
+    def search(self, gs, max_depth = MAX_DEPTH, time_limit = None, max_nodes = None, info = None, root_moves = None):
+
+        if info is None:
+            info = search_info()
+        info.start_time = time.time()
+        info.apply_hit()
+
+        if root_moves is None:
+            root = gs.valid_moves_packed()
         else:
-        '''
-        score = turn * score_material(gs.board)
-        
-        if score > max_score:
-            max_score = score
-            best_move = player_move
+            root = [player_move.packed for player_move in root_moves]
+        if len(root) == 0:
+            return None, -CHECKMATE if gs.in_check else STALEMATE, []
+
+        info.best_move = chess_engine.move_from_packed(root[0], gs.board)
+
+        self.search_id += 1
+        self.stop_event.clear()
+        fen = gs.get_fen()
+        self.table_stats = {}
+
+        # the node budget is split between the workers, so together they search no more than max_nodes
+        if max_nodes is not None:
+            max_nodes = max(1, max_nodes // len(self.workers))
+
+        for jobs in self.jobs:
+            jobs.put((self.search_id, fen, max_depth, time_limit, max_nodes, list(root)))
+
+        best_depth = 0
+        nodes = [0] * len(self.workers)
+        finished = 0
+
+        while finished < len(self.workers):
+
+            # a stop from another thread sets info.stopped (or a deadline set after the start, see ponder_hit),
+            # pass it on to the workers
+            if info.deadline is not None and time.time() >= info.deadline:
+                info.stopped = True
+            if info.stopped:
+                self.stop_event.set()
+
+            try:
+                search_id, worker_id, depth, score, pv, worker_nodes, table_stats = self.results.get(timeout = 0.05)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    break
+                continue
+
+            # left over from an earlier search
+            if search_id != self.search_id:
+                continue
+
+            nodes[worker_id] = worker_nodes
+            info.nodes = sum(nodes)
+
+            # a worker is done, the first one to finish ends the search for all of them
+            if depth is None:
+                finished += 1
+                self.stop_event.set()
+                for name, count in table_stats.items():
+                    if name in ("slots", "replacement"):
+                        self.table_stats[name] = count
+                    else:
+                        self.table_stats[name] = self.table_stats.get(name, 0) + count
+                continue
+
+            if depth > best_depth:
+                best_depth = depth
+                info.depth = depth
+                info.score = score
+                info.pv = to_moves(gs, pv)
+                info.best_move = info.pv[0]
+                if info.on_iteration is not None:
+                    info.on_iteration(info)
+
+        return info.best_move, info.score, info.pv
+
+    # stop the workers and free the shared table
+    def close(self):
+        self.stop_event.set()
+        for jobs in self.jobs:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        self.memory.close()
+        self.memory.unlink()
+
+# worker process body, runs searches for parallel_searcher until it's sent None
+def parallel_worker(worker_id, memory_name, size_mb, replacement, evaluator_name, network_path, jobs, results,
+                    stop_event):
+    global hash_table
+
+    memory = shared_memory.SharedMemory(name = memory_name)
+    hash_table = transposition.transposition_table(size_mb, replacement, shared = memory.buf)
+    set_evaluator(evaluator_name, network_path)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        search_id, fen, max_depth, time_limit, max_nodes, root = job
+        gs = chess_engine.game_state("bitboard", fen = fen)
+        root_moves = [chess_engine.move_from_packed(m, gs.board) for m in root]
+
+        # report every completed depth to the main process
+        info = search_info()
+        info.stop_event = stop_event
+        info.on_iteration = lambda info: results.put((search_id, worker_id, info.depth, info.score,
+                                                      [player_move.packed for player_move in info.pv], info.nodes,
+                                                      None))
 
-        gs.undo_move(player_move)
+        search(gs, max_depth, time_limit, max_nodes, info, root_moves, start_depth = 1 + worker_id % 2)
+        results.put((search_id, worker_id, None, 0, [], info.nodes, hash_table.stats()))
 
-    return best_move
+    # the table's views into the shared memory have to go before it can be closed
+    hash_table = None
+    memory.close()
 
 def score_material(board):
 
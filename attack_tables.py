@@ -0,0 +1,138 @@
+# attack tables built once at import, shared by the list and bitboard move generators
+# squares are numbered row * 8 + col (a8 is 0, h1 is 63), the same as the bitboard backend
+
+# ray directions as (row, col) steps, orthogonal first then diagonal (same order as check_pins_checks)
+DIRECTIONS = ((-1, 0), (0, -1), (0, 1), (1, 0), (-1, -1), (-1, 1), (1, 1), (1, -1))
+ROOK_RAYS = (0, 1, 2, 3)
+BISHOP_RAYS = (4, 5, 6, 7)
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+def on_board(row, col):
+    return 0 <= row < 8 and 0 <= col < 8
+
+def leaper_squares(offsets):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        table.append(tuple((row + d[0], col + d[1]) for d in offsets if on_board(row + d[0], col + d[1])))
+    return tuple(table)
+
+def ray_squares(d):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        ray = []
+        for i in range(1, 8):
+            if not on_board(row + d[0] * i, col + d[1] * i):
+                break
+            ray.append((row + d[0] * i, col + d[1] * i))
+        table.append(tuple(ray))
+    return tuple(table)
+
+def to_mask(coords):
+    mask = 0
+    for row, col in coords:
+        mask |= 1 << (row * 8 + col)
+    return mask
+
+# (row, col) target lists for the list board generators
+KNIGHT_SQUARES = leaper_squares(KNIGHT_OFFSETS)
+KING_SQUARES = leaper_squares(KING_OFFSETS)
+RAY_SQUARES = tuple(ray_squares(d) for d in DIRECTIONS)
+
+# the same tables as bitboards
+KNIGHT_ATTACKS = tuple(to_mask(targets) for targets in KNIGHT_SQUARES)
+KING_ATTACKS = tuple(to_mask(targets) for targets in KING_SQUARES)
+# indexed by colour (0 white, 1 black) then square
+PAWN_ATTACKS = (
+    tuple(to_mask(targets) for targets in leaper_squares(((-1, -1), (-1, 1)))), # white pawns capture up the board
+    tuple(to_mask(targets) for targets in leaper_squares(((1, -1), (1, 1)))) # black pawns capture down
+)
+RAYS = tuple(tuple(to_mask(ray) for ray in rays) for rays in RAY_SQUARES)
+
+# index of the lowest set bit
+def lsb(b):
+    return (b & -b).bit_length() - 1
+
+# sliding attacks from precomputed rays: the first blocker on each ray is found with one bit scan
+# and everything past it is cut off with that blocker's own ray, so the cost doesn't depend on ray length
+# (n, w, nw and ne rays step towards lower square numbers, so their nearest blocker is the highest set bit)
+N_RAYS, W_RAYS, E_RAYS, S_RAYS, NW_RAYS, NE_RAYS, SE_RAYS, SW_RAYS = RAYS
+
+def rook_attacks(sq, occ):
+    attacks = 0
+
+    ray = N_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= N_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = W_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= W_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = E_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= E_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    ray = S_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= S_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    return attacks
+
+def bishop_attacks(sq, occ):
+    attacks = 0
+
+    ray = NW_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= NW_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = NE_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= NE_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = SE_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= SE_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    ray = SW_RAYS[sq]
+    blockers = ray & occ
+    if blockers:
+        ray ^= SW_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    return attacks
+
+def queen_attacks(sq, occ):
+    return rook_attacks(sq, occ) | bishop_attacks(sq, occ)
+
+# squares strictly between two squares on a shared rank, file or diagonal (0 otherwise)
+def build_between():
+    table = []
+    for a in range(64):
+        row = [0] * 64
+        for rays in RAYS:
+            ray = rays[a]
+            for b in range(64):
+                if (ray >> b) & 1:
+                    row[b] = ray & ~rays[b] & ~(1 << b)
+        table.append(tuple(row))
+    return tuple(table)
+
+BETWEEN = build_between()
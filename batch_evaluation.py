@@ -0,0 +1,78 @@
+# numpy batch version of evaluation: scores many positions at once from (N, 12, 64) piece planes
+# plane order is bitboard.PIECES (white pawn ... black king), squares are game_state's (a8 = 0, h1 = 63)
+# scores match evaluation.evaluate_board + evaluation.tapered exactly, in centipawns from white's point of view
+
+import numpy as np
+import bitboard
+import evaluation
+
+# (12, 64) score tables and (12,) phase weights, in plane order
+MG_WEIGHTS = np.array([evaluation.MG_SCORES[piece] for piece in bitboard.PIECES], dtype = np.int32)
+EG_WEIGHTS = np.array([evaluation.EG_SCORES[piece] for piece in bitboard.PIECES], dtype = np.int32)
+PHASE_WEIGHTS = np.array([evaluation.PHASE[piece] for piece in bitboard.PIECES], dtype = np.int32)
+
+SQUARE_BITS = np.arange(64, dtype = np.uint64)
+
+# (12, 64) planes for one list board
+def encode(board):
+    planes = np.zeros((12, 64), dtype = np.uint8)
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != "--":
+                planes[bitboard.PIECE_INDEX[piece], row * 8 + col] = 1
+    return planes
+
+# (N, 12, 64) planes for a list of game_states (or list boards), built from their bitboards
+def encode_many(positions):
+    return unpack(pack_many(positions))
+
+# (N, 12) uint64 piece bitboards, the packed form (8x smaller than planes), from game_states or list boards
+def pack_many(positions):
+    packed = np.zeros((len(positions), 12), dtype = np.uint64)
+    for i, position in enumerate(positions):
+        bitboards = getattr(position, "bitboards", None)
+        if bitboards is None:
+            bitboards = bitboard.bitboard_position(getattr(position, "board", position))
+        packed[i] = bitboards.pieces
+    return packed
+
+# unpack (N, 12) bitboards to (N, 12, 64) planes
+def unpack(packed):
+    return ((packed[:, :, None] >> SQUARE_BITS) & np.uint64(1)).astype(np.uint8)
+
+# scores for (N, 12, 64) planes (or (N, 12) packed bitboards), from white's point of view,
+# or from the side to move's if white_to_move (N bools) is given
+def evaluate_planes(planes, white_to_move = None):
+
+    planes = np.asarray(planes)
+    if planes.ndim == 2:
+        planes = unpack(planes)
+    planes = planes.astype(np.int32, copy = False)
+
+    mg = np.einsum("nps,ps->n", planes, MG_WEIGHTS)
+    eg = np.einsum("nps,ps->n", planes, EG_WEIGHTS)
+    phase = np.minimum(planes.sum(axis = 2) @ PHASE_WEIGHTS, evaluation.MAX_PHASE)
+
+    scores = (mg * phase + eg * (evaluation.MAX_PHASE - phase)) // evaluation.MAX_PHASE
+
+    if white_to_move is not None:
+        scores = np.where(np.asarray(white_to_move, dtype = bool), scores, -scores)
+    return scores
+
+# score a list of game_states, each from its own side to move's point of view
+def evaluate_many(positions):
+    return evaluate_planes(encode_many(positions), [gs.white_to_move for gs in positions])
+
+# scores of every legal move from gs (packed moves, scores from gs's side to move's point of view)
+def evaluate_children(gs):
+
+    moves = gs.valid_moves_packed()
+    planes = np.zeros((len(moves), 12, 64), dtype = np.uint8)
+    for i, m in enumerate(moves):
+        gs.make_packed(m)
+        planes[i] = encode(gs.board)
+        gs.undo_packed()
+
+    scores = evaluate_planes(planes)
+    return moves, scores if gs.white_to_move else -scores
@@ -0,0 +1,248 @@
+# bitboard backend for game_state: twelve piece bitboards plus occupancy masks
+# squares are numbered row * 8 + col to match the list board, so a8 is bit 0 and h1 is bit 63
+
+from attack_tables import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BETWEEN, lsb, rook_attacks, bishop_attacks, queen_attacks
+from move_encoding import PROMOTION, ENPASSANT, CASTLE
+
+# piece order for the bitboard list (white pieces first, then black)
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+
+# occupancy indices
+WHITE = 0
+BLACK = 1
+BOTH = 2
+
+# piece offsets within a colour (white base is 0, black base is 6)
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+# first and last rows, where pawns promote
+PROMOTION_ROWS = 0xFF | (0xFF << 56)
+
+# yield the square of every set bit, lowest first
+def squares(b):
+    while b:
+        low = b & -b
+        yield low.bit_length() - 1
+        b ^= low
+
+class bitboard_position():
+
+    # constructor (builds the bitboards from a list board)
+    def __init__(self, board):
+        self.pieces = [0] * 12
+        self.occupancy = [0, 0, 0]
+
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] != "--":
+                    self.add_piece(row * 8 + col, board[row][col])
+
+    def add_piece(self, sq, piece):
+        b = 1 << sq
+        self.pieces[PIECE_INDEX[piece]] |= b
+        self.occupancy[WHITE if piece[0] == "w" else BLACK] |= b
+        self.occupancy[BOTH] |= b
+
+    def remove_piece(self, sq, piece):
+        b = ~(1 << sq)
+        self.pieces[PIECE_INDEX[piece]] &= b
+        self.occupancy[WHITE if piece[0] == "w" else BLACK] &= b
+        self.occupancy[BOTH] &= b
+
+    # mirror a single square change made on the list board
+    def update_square(self, sq, old_piece, new_piece):
+        if old_piece != "--":
+            self.remove_piece(sq, old_piece)
+        if new_piece != "--":
+            self.add_piece(sq, new_piece)
+
+    # bitboard of the pieces of colour that attack sq, given an occupancy
+    def attackers_to(self, sq, colour, occ):
+        p = self.pieces
+        base = 0 if colour == WHITE else 6
+
+        # a pawn attacks sq if a pawn of the other colour on sq would attack it back
+        attackers = PAWN_ATTACKS[1 - colour][sq] & p[base + PAWN]
+        attackers |= KNIGHT_ATTACKS[sq] & p[base + KNIGHT]
+        attackers |= KING_ATTACKS[sq] & p[base + KING]
+        attackers |= bishop_attacks(sq, occ) & (p[base + BISHOP] | p[base + QUEEN])
+        attackers |= rook_attacks(sq, occ) & (p[base + ROOK] | p[base + QUEEN])
+        return attackers
+
+    def king_square(self, colour):
+        return lsb(self.pieces[(0 if colour == WHITE else 6) + KING])
+
+    def in_check(self, white_to_move):
+        us = WHITE if white_to_move else BLACK
+        return self.attackers_to(self.king_square(us), 1 - us, self.occupancy[BOTH]) != 0
+
+    # append all legal moves to moves as packed ints (see move_encoding), and return it
+    # captures_only keeps captures, enpassant and promotions (checks adds quiet moves that give check, directly, by
+    # discovery or by the rook of a castle, the same moves as game_state.gives_check finds)
+    def legal_moves(self, white_to_move, rights, enpassant, moves, captures_only = False, checks = False):
+
+        us = WHITE if white_to_move else BLACK
+        them = 1 - us
+        base = 0 if us == WHITE else 6
+        enemy_base = 6 - base
+
+        p = self.pieces
+        own = self.occupancy[us]
+        enemy = self.occupancy[them]
+        occ = self.occupancy[BOTH]
+        king = lsb(p[base + KING])
+
+        append = moves.append
+        checkers = self.attackers_to(king, them, occ)
+
+        # squares each piece type may move to (everything, or just the tactical targets)
+        # discovers maps a piece of ours shielding the enemy king from one of our sliders to the line it shields,
+        # any move off that line gives check
+        discovers = {}
+        if captures_only:
+            allowed = [enemy] * 6
+            allowed[PAWN] |= 0xFF if us == WHITE else 0xFF << 56 # promotion pushes
+
+            if checks:
+                enemy_king = lsb(p[enemy_base + KING])
+                allowed[PAWN] |= PAWN_ATTACKS[them][enemy_king]
+                allowed[KNIGHT] |= KNIGHT_ATTACKS[enemy_king]
+                allowed[BISHOP] |= bishop_attacks(enemy_king, occ)
+                allowed[ROOK] |= rook_attacks(enemy_king, occ)
+                allowed[QUEEN] |= allowed[BISHOP] | allowed[ROOK]
+
+                for attacks, sliders in ((rook_attacks, p[base + ROOK] | p[base + QUEEN]),
+                                         (bishop_attacks, p[base + BISHOP] | p[base + QUEEN])):
+                    for sniper in squares(attacks(enemy_king, enemy) & sliders):
+                        line = BETWEEN[enemy_king][sniper]
+                        blockers = line & occ
+                        if blockers and not blockers & (blockers - 1) and blockers & own:
+                            discovers[lsb(blockers)] = line | (1 << sniper)
+        else:
+            allowed = [FULL] * 6
+
+        # king moves (tested with the king lifted off the board so it can't block a ray onto itself)
+        occ_without_king = occ ^ (1 << king)
+        king_allowed = allowed[KING]
+        if king in discovers:
+            king_allowed |= FULL ^ discovers[king]
+        for end in squares(KING_ATTACKS[king] & ~own & king_allowed):
+            if not self.attackers_to(end, them, occ_without_king):
+                append(king | (end << 6))
+
+        # double check, only the king can move
+        if checkers & (checkers - 1):
+            return moves
+
+        # squares that capture or block the single checker
+        if checkers:
+            check_mask = checkers | BETWEEN[king][lsb(checkers)]
+        else:
+            check_mask = FULL
+
+        # pinned pieces may only move along the line between the king and the pinner
+        pins = {}
+        for attacks, sliders in ((rook_attacks, p[enemy_base + ROOK] | p[enemy_base + QUEEN]),
+                                 (bishop_attacks, p[enemy_base + BISHOP] | p[enemy_base + QUEEN])):
+            for pinner in squares(attacks(king, enemy) & sliders):
+                line = BETWEEN[king][pinner]
+                blockers = line & occ
+                if blockers and not blockers & (blockers - 1) and blockers & own:
+                    pins[lsb(blockers)] = line | (1 << pinner)
+
+        # pawns
+        forward = -8 if us == WHITE else 8
+        start_row = 6 if us == WHITE else 1
+        for start in squares(p[base + PAWN]):
+            one = start + forward
+            targets = 0
+            if not (occ >> one) & 1:
+                targets |= 1 << one
+                if start >> 3 == start_row and not (occ >> (one + forward)) & 1:
+                    targets |= 1 << (one + forward)
+            attacks = PAWN_ATTACKS[us][start]
+            targets |= attacks & enemy
+            if start in discovers:
+                targets &= check_mask & (allowed[PAWN] | (FULL ^ discovers[start]))
+            else:
+                targets &= check_mask & allowed[PAWN]
+            if start in pins:
+                targets &= pins[start]
+            for end in squares(targets):
+                if (PROMOTION_ROWS >> end) & 1:
+                    # one move per promotion piece, queen first
+                    for promotion in (3, 0, 2, 1):
+                        append(start | (end << 6) | (PROMOTION << 12) | (promotion << 14))
+                else:
+                    append(start | (end << 6))
+
+            # en passant, simulated in full since it removes two pieces from the same rank
+            if enpassant:
+                ep = enpassant[0] * 8 + enpassant[1]
+                if (attacks >> ep) & 1:
+                    captured = ep - forward
+                    p[enemy_base + PAWN] ^= 1 << captured
+                    after = (occ ^ (1 << start) ^ (1 << captured)) | (1 << ep)
+                    if not self.attackers_to(king, them, after):
+                        append(start | (ep << 6) | (ENPASSANT << 12))
+                    p[enemy_base + PAWN] ^= 1 << captured
+
+        # knights, bishops, rooks and queens
+        for piece in (KNIGHT, BISHOP, ROOK, QUEEN):
+            for start in squares(p[base + piece]):
+                if piece == KNIGHT:
+                    targets = KNIGHT_ATTACKS[start]
+                elif piece == BISHOP:
+                    targets = bishop_attacks(start, occ)
+                elif piece == ROOK:
+                    targets = rook_attacks(start, occ)
+                else:
+                    targets = queen_attacks(start, occ)
+                if start in discovers:
+                    targets &= ~own & check_mask & (allowed[piece] | (FULL ^ discovers[start]))
+                else:
+                    targets &= ~own & check_mask & allowed[piece]
+                if start in pins:
+                    targets &= pins[start]
+                for end in squares(targets):
+                    append(start | (end << 6))
+
+        # castling (king must be home, squares between empty, and not pass through an attacked square)
+        # in captures_only mode only a castle that gives check is kept, and only when checks is set
+        if not checkers and (not captures_only or checks):
+            row = 7 if us == WHITE else 0
+            home = row * 8 + 4
+            rooks = p[base + ROOK]
+            king_side = rights.wks if us == WHITE else rights.bks
+            queen_side = rights.wqs if us == WHITE else rights.bqs
+
+            if king == home and king_side and (rooks >> (home + 3)) & 1:
+                if not (occ >> (home + 1)) & 1 and not (occ >> (home + 2)) & 1:
+                    if not self.attackers_to(home + 1, them, occ) and not self.attackers_to(home + 2, them, occ):
+                        if not captures_only or self.castle_checks(home, home + 2, home + 3, home + 1, enemy_king, occ):
+                            append(home | ((home + 2) << 6) | (CASTLE << 12))
+
+            if king == home and queen_side and (rooks >> (home - 4)) & 1:
+                if not (occ >> (home - 1)) & 1 and not (occ >> (home - 2)) & 1 and not (occ >> (home - 3)) & 1:
+                    if not self.attackers_to(home - 1, them, occ) and not self.attackers_to(home - 2, them, occ):
+                        if not captures_only or self.castle_checks(home, home - 2, home - 4, home - 1, enemy_king, occ):
+                            append(home | ((home - 2) << 6) | (CASTLE << 12))
+
+        return moves
+
+    # does castling (king from king_start to king_end, rook from rook_start to rook_end) give check
+    def castle_checks(self, king_start, king_end, rook_start, rook_end, enemy_king, occ):
+        after = occ ^ (1 << king_start) ^ (1 << rook_start) | (1 << king_end) | (1 << rook_end)
+        us = WHITE if (self.occupancy[WHITE] >> king_start) & 1 else BLACK
+        base = 0 if us == WHITE else 6
+        p = self.pieces
+
+        # the rook on its new square, or a slider the king uncovered
+        if (rook_attacks(rook_end, after) >> enemy_king) & 1:
+            return True
+        rooks = (p[base + ROOK] ^ (1 << rook_start)) | p[base + QUEEN]
+        return (rook_attacks(enemy_king, after) & rooks) != 0 or \
+            (bishop_attacks(enemy_king, after) & (p[base + BISHOP] | p[base + QUEEN])) != 0
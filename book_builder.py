@@ -0,0 +1,316 @@
+# build a polyglot opening book from pgn files, the native replacement for poly-make.bat
+#
+# pgn files are split into chunks on game boundaries and replayed in parallel, one worker process per chunk
+# each worker counts (position, move) -> games played and points scored, and spills its counts to a sorted run
+# file whenever it holds too many, so memory stays bounded however big the input is
+# the run files are then merged in one streaming pass straight into the .bin
+#
+# usage: python book_builder.py games.pgn [more.pgn ...] -o book.bin [--max-ply 20] [--min-game 1] [--workers N]
+
+import argparse
+import heapq
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import chess_engine
+import polyglot_book
+from move_encoding import PROMOTION, ENPASSANT, CASTLE, start_square, end_square, flag, promotion_piece
+
+# run file record: key, polyglot move, games, points (2 for a win, 1 for a draw, from the side that moved)
+RECORD = struct.Struct("<QHII")
+
+MAX_PLY = 20
+MIN_GAME = 1
+CHUNK_BYTES = 16 * 1024 * 1024
+MAX_ENTRIES = 1000000 # (position, move) counts a worker holds before spilling them to disk
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# points for the side that moved, by result (unfinished games count as draws)
+POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+# movetext noise: comments, variations (innermost first), nags, move numbers and results
+COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION = re.compile(r"\([^()]*\)")
+TOKEN_NOISE = re.compile(r"\$\d+|\d+\.(\.\.)?|1-0|0-1|1/2-1/2|\*")
+
+SAN_MOVE = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(=?([NBRQ]))?$")
+
+# split a file into byte ranges for the workers (each worker moves its start and end up to the next game)
+def chunks(path, chunk_bytes = CHUNK_BYTES):
+    size = os.path.getsize(path)
+    return [(path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+# yield (headers, movetext) for each game that starts in [start, end) of a pgn file, reading one line at a time
+def read_games(path, start = 0, end = None):
+
+    with open(path, "rb") as pgn:
+
+        # start from the beginning of the line holding start (a game whose first line starts at start is ours)
+        if start > 0:
+            pgn.seek(start - 1)
+            pgn.readline()
+
+        # a chunk that begins mid-game leaves that game to the chunk before it
+        in_game = start == 0
+        headers = {}
+        movetext = []
+        offset = pgn.tell()
+        line = pgn.readline()
+
+        while line:
+            text = line.decode("utf-8", "replace").strip()
+
+            if text.startswith("[Event "):
+                if headers or movetext:
+                    yield headers, " ".join(movetext)
+                    headers = {}
+                    movetext = []
+                if end is not None and offset >= end:
+                    return
+                in_game = True
+
+            if in_game:
+                if text.startswith("[") and text.endswith("]"):
+                    name, space, value = text[1:-1].partition(" ")
+                    headers[name] = value.strip().strip('"')
+                elif text:
+                    movetext.append(text)
+
+            offset = pgn.tell()
+            line = pgn.readline()
+
+        if headers or movetext:
+            yield headers, " ".join(movetext)
+
+# split movetext into san moves
+def san_moves(movetext):
+
+    movetext = COMMENT.sub(" ", movetext)
+    while True:
+        stripped = VARIATION.sub(" ", movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+
+    return TOKEN_NOISE.sub(" ", movetext).split()
+
+# find the legal packed move in gs for a san move, or None
+def parse_san(gs, san, moves):
+
+    san = san.rstrip("+#!?")
+
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        row = 7 if gs.white_to_move else 0
+        end = row * 8 + (6 if len(san) == 3 else 2)
+        for m in moves:
+            if flag(m) == CASTLE and end_square(m) == end:
+                return m
+        return None
+
+    match = SAN_MOVE.match(san)
+    if match is None:
+        return None
+
+    piece, from_file, from_rank, to_square, promotion_part, promotion = match.groups()
+    piece = piece or "P"
+    end = chess_engine.move.ranks_to_rows[to_square[1]] * 8 + chess_engine.move.files_to_cols[to_square[0]]
+    board = gs.board
+
+    found = None
+    for m in moves:
+        if end_square(m) != end:
+            continue
+        start = start_square(m)
+        if board[start >> 3][start & 7][1] != piece:
+            continue
+        if from_file is not None and start & 7 != chess_engine.move.files_to_cols[from_file]:
+            continue
+        if from_rank is not None and start >> 3 != chess_engine.move.ranks_to_rows[from_rank]:
+            continue
+        if flag(m) == PROMOTION and promotion_piece(m) != (promotion or "Q"):
+            continue
+
+        # ambiguous san, don't guess
+        if found is not None:
+            return None
+        found = m
+
+    return found
+
+# san for the legal packed move m in gs (moves is gs's legal move list), with + or # for check and mate
+def to_san(gs, m, moves):
+
+    start = start_square(m)
+    end = end_square(m)
+    move_flag = flag(m)
+    board = gs.board
+    piece = board[start >> 3][start & 7][1]
+    square = "abcdefgh"[end & 7] + str(8 - (end >> 3))
+    capture = board[end >> 3][end & 7] != "--" or move_flag == ENPASSANT
+
+    if move_flag == CASTLE:
+        san = "O-O" if end & 7 == 6 else "O-O-O"
+    elif piece == "P":
+        san = ("abcdefgh"[start & 7] + "x" if capture else "") + square
+        if move_flag == PROMOTION:
+            san += "=" + promotion_piece(m)
+    else:
+        # name the file, the rank, or both when another piece of the same kind can reach the square
+        others = [start_square(other) for other in moves if end_square(other) == end and start_square(other) != start and
+                  board[start_square(other) >> 3][start_square(other) & 7][1] == piece]
+        origin = ""
+        if others:
+            if all(other & 7 != start & 7 for other in others):
+                origin = "abcdefgh"[start & 7]
+            elif all(other >> 3 != start >> 3 for other in others):
+                origin = str(8 - (start >> 3))
+            else:
+                origin = "abcdefgh"[start & 7] + str(8 - (start >> 3))
+        san = piece + origin + ("x" if capture else "") + square
+
+    gs.make_packed(m)
+    replies = gs.valid_moves_packed()
+    if gs.in_check:
+        san += "+" if replies else "#"
+    gs.undo_packed()
+
+    return san
+
+# replay one game, adding its first max_ply moves to counts, returns False if a move couldn't be read
+def add_game(gs, headers, movetext, counts, max_ply = MAX_PLY):
+
+    if "FEN" in headers:
+        gs.load_fen(headers["FEN"])
+    else:
+        gs.load_fen(STARTING_FEN)
+
+    white_points, black_points = POINTS.get(headers.get("Result"), (1, 1))
+
+    for ply, san in enumerate(san_moves(movetext)):
+        if ply >= max_ply:
+            break
+
+        m = parse_san(gs, san, gs.valid_moves_packed())
+        if m is None:
+            return False
+
+        entry = (gs.zobrist_key, polyglot_book.to_polyglot(m))
+        games, points = counts.get(entry, (0, 0))
+        counts[entry] = (games + 1, points + (white_points if gs.white_to_move else black_points))
+
+        gs.make_packed(m)
+
+    return True
+
+# write counts to a new run file sorted by (key, move), and empty them
+def spill(counts, directory):
+
+    run, path = tempfile.mkstemp(suffix = ".run", dir = directory)
+    with os.fdopen(run, "wb") as out:
+        for (key, raw) in sorted(counts):
+            games, points = counts[(key, raw)]
+            out.write(RECORD.pack(key, raw, games, points))
+    counts.clear()
+    return path
+
+# worker: replay the games of one chunk, returns (run file paths, games read, games skipped)
+def build_chunk(path, start, end, directory, max_ply = MAX_PLY, max_entries = MAX_ENTRIES):
+
+    gs = chess_engine.game_state("bitboard")
+    counts = {}
+    runs = []
+    games = 0
+    skipped = 0
+
+    for headers, movetext in read_games(path, start, end):
+        games += 1
+        try:
+            if not add_game(gs, headers, movetext, counts, max_ply):
+                skipped += 1
+        except ValueError:
+            skipped += 1 # bad FEN tag
+
+        if len(counts) >= max_entries:
+            runs.append(spill(counts, directory))
+
+    if counts:
+        runs.append(spill(counts, directory))
+
+    return runs, games, skipped
+
+def read_run(path):
+    with open(path, "rb") as run:
+        while True:
+            record = run.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            yield RECORD.unpack(record)
+
+# merge sorted run files, summing counts for the same (key, move), yields (key, move, weight)
+def merge_runs(runs, min_game = MIN_GAME):
+
+    current = None
+    games = points = 0
+    for key, raw, run_games, run_points in heapq.merge(*[read_run(run) for run in runs]):
+        if (key, raw) != current:
+            if current is not None and games >= min_game:
+                yield current[0], current[1], points
+            current = (key, raw)
+            games = points = 0
+        games += run_games
+        points += run_points
+
+    if current is not None and games >= min_game:
+        yield current[0], current[1], points
+
+# build a polyglot book from pgn files, returns (games read, games skipped)
+def build_book(pgn_paths, output, max_ply = MAX_PLY, min_game = MIN_GAME, workers = None,
+               chunk_bytes = CHUNK_BYTES, max_entries = MAX_ENTRIES):
+
+    jobs = []
+    for path in pgn_paths:
+        jobs.extend(chunks(path, chunk_bytes))
+
+    games = 0
+    skipped = 0
+    with tempfile.TemporaryDirectory() as directory:
+        runs = []
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(build_chunk, path, start, end, directory, max_ply, max_entries) for path, start, end in jobs]
+            for future in futures:
+                chunk_runs, chunk_games, chunk_skipped = future.result()
+                runs.extend(chunk_runs)
+                games += chunk_games
+                skipped += chunk_skipped
+
+        polyglot_book.write_polyglot(output, merge_runs(runs, min_game))
+
+    return games, skipped
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "build a polyglot opening book from pgn files")
+    parser.add_argument("pgn", nargs = "+", help = "pgn files to read")
+    parser.add_argument("-o", "--output", required = True, help = "polyglot book to write")
+    parser.add_argument("--max-ply", type = int, default = MAX_PLY, help = "moves per game to add (default 20)")
+    parser.add_argument("--min-game", type = int, default = MIN_GAME, help = "games a move needs to be kept (default 1)")
+    parser.add_argument("--workers", type = int, help = "worker processes (default: all cores)")
+    parser.add_argument("--chunk-mb", type = float, default = CHUNK_BYTES / (1024 * 1024), help = "pgn bytes per job")
+    parser.add_argument("--max-entries", type = int, default = MAX_ENTRIES, help = "counts a worker holds before spilling")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    games, skipped = build_book(args.pgn, args.output, args.max_ply, args.min_game, args.workers,
+                                max(int(args.chunk_mb * 1024 * 1024), 1), args.max_entries)
+    entries = os.path.getsize(args.output) // polyglot_book.ENTRY_BYTES
+
+    print("{} games ({} skipped), {} entries written to {} in {:.1f}s".format(games, skipped, entries, args.output,
+                                                                          time.time() - start))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,21 @@
 # stores information about the current state of the board, and responsible for determining valid moves
 
+import attack_tables
+import bitboard
+import evaluation
+import zobrist
+from move_encoding import NORMAL, PROMOTION, ENPASSANT, CASTLE, PROMOTION_INDEX, MATCH_MASK, pack, start_square, \
+    end_square, flag, promotion_piece
+
+# fen piece letters
+FEN_PIECES = {"P": "wP", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bP", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+
 class game_state():
 
-    # constructor
-    def __init__(self):
+    # constructor (backend is "list" to walk self.board, or "bitboard" to generate moves from piece bitboards,
+    # fen sets up a position other than the start position)
+    def __init__(self, backend = "list", fen = None):
 
         # board represented by list of lists (8x8 board) 
         self.board = [
@@ -26,7 +38,8 @@ class game_state():
 
         self.white_to_move = True
 
-        self.move_log = []
+        self.move_log = [] # packed moves (see move_encoding)
+        self.captured_log = [] # piece taken by each move in move_log ("--" for none)
         self.white_king_location = (7, 4)
         self.black_king_location = (0, 4)
         
@@ -35,120 +48,379 @@ class game_state():
         self.checks = []
 
         self.possible_enpassant = () # possible coordinates for enpassant
+        self.enpassant_log = [self.possible_enpassant]
 
         self.current_castling_rights = castling_rights(True, True, True, True)
-        self.castle_rights_log = [castling_rights(self.current_castling_rights.wks, self.current_castling_rights.wqs,
-                                                  self.current_castling_rights.bks, self.current_castling_rights.bqs)]
+        self.castle_rights_log = [self.current_castling_rights.copy()]
+
+        # move counters (plies since the last capture or pawn move, and the fen move number)
+        self.halfmove_clock = 0
+        self.halfmove_log = [self.halfmove_clock]
+        self.fullmove_number = 1
+
+        # the list board is always kept, the bitboard backend mirrors every change made to it
+        self.backend = backend
+        self.bitboards = None
+
+        if backend == "bitboard":
+            self.bitboards = bitboard.bitboard_position(self.board)
+        elif backend != "list":
+            raise ValueError("unknown backend: " + str(backend))
+
+        # 64 bit polyglot compatible zobrist key, updated incrementally by make_move and undo_move
+        self.zobrist_key = zobrist.hash_position(self)
+
+        # tapered piece-square evaluation sums (see evaluation), also kept up to date in set_square
+        self.mg_score, self.eg_score, self.phase = evaluation.evaluate_board(self.board)
+
+        # nnue accumulator, attached by nnue_network.evaluate when the ai uses that evaluator (updated in set_square)
+        self.nnue = None
+
+        if fen is not None:
+            self.load_fen(fen)
+
+    # set up a position from fen (the move counters may be left off, as they are in epd)
+    def load_fen(self, fen):
+
+        fields = fen.split()
+        if len(fields) < 4 or len(fields) > 6:
+            raise ValueError("invalid fen: " + fen)
+
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("invalid fen board: " + fields[0])
+
+        board = []
+        white_king_location = None
+        black_king_location = None
+        for rank in rows:
+            row = []
+            for char in rank:
+                if char in "12345678":
+                    row.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    if char == "K":
+                        white_king_location = (len(board), len(row))
+                    elif char == "k":
+                        black_king_location = (len(board), len(row))
+                    row.append(FEN_PIECES[char])
+                else:
+                    raise ValueError("invalid fen board: " + fields[0])
+            if len(row) != 8:
+                raise ValueError("invalid fen board: " + fields[0])
+            board.append(row)
+
+        if white_king_location is None or black_king_location is None:
+            raise ValueError("fen needs both kings: " + fields[0])
+        if fields[1] not in ("w", "b"):
+            raise ValueError("invalid fen side to move: " + fields[1])
+        if fields[2] != "-" and (not fields[2] or fields[2].strip("KQkq")):
+            raise ValueError("invalid fen castling rights: " + fields[2])
+
+        if fields[3] == "-":
+            enpassant = ()
+        elif len(fields[3]) == 2 and fields[3][0] in move.files_to_cols and fields[3][1] in ("3", "6"):
+            enpassant = (move.ranks_to_rows[fields[3][1]], move.files_to_cols[fields[3][0]])
+        else:
+            raise ValueError("invalid fen enpassant square: " + fields[3])
+
+        self.board = board
+        self.white_king_location = white_king_location
+        self.black_king_location = black_king_location
+        self.white_to_move = fields[1] == "w"
+
+        self.move_log = []
+        self.captured_log = []
+        self.in_check = False
+        self.pins = []
+        self.checks = []
+
+        self.possible_enpassant = enpassant
+        self.enpassant_log = [self.possible_enpassant]
+
+        # a right only counts while its king and rook are still on their home squares (as python-chess cleans them),
+        # the move generators and the zobrist key rely on that
+        white_home = board[7][4] == "wK"
+        black_home = board[0][4] == "bK"
+        self.current_castling_rights = castling_rights("K" in fields[2] and white_home and board[7][7] == "wR",
+                                                       "k" in fields[2] and black_home and board[0][7] == "bR",
+                                                       "Q" in fields[2] and white_home and board[7][0] == "wR",
+                                                       "q" in fields[2] and black_home and board[0][0] == "bR")
+        self.castle_rights_log = [self.current_castling_rights.copy()]
+
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.halfmove_log = [self.halfmove_clock]
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+
+        if self.bitboards is not None:
+            self.bitboards = bitboard.bitboard_position(self.board)
+        self.zobrist_key = zobrist.hash_position(self)
+        self.mg_score, self.eg_score, self.phase = evaluation.evaluate_board(self.board)
+        self.nnue = None
+
+    # fen of the current position
+    def get_fen(self):
+        return self.get_epd_position() + " " + str(self.halfmove_clock) + " " + str(self.fullmove_number)
+
+    # first four fen fields (board, side to move, castling rights, enpassant square), shared by fen and epd
+    def get_epd_position(self):
+
+        rows = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            rows.append(rank)
+
+        rights = self.current_castling_rights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+
+        if self.possible_enpassant:
+            enpassant = move.cols_to_files[self.possible_enpassant[1]] + move.rows_to_ranks[self.possible_enpassant[0]]
+        else:
+            enpassant = "-"
+
+        return "/".join(rows) + " " + ("w" if self.white_to_move else "b") + " " + (castling or "-") + " " + enpassant
+
+    # set up a position from an epd line, returns its operations as {opcode: operand string}
+    # (hmvc and fmvn operations set the move counters)
+    def load_epd(self, epd):
+
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("invalid epd: " + epd)
+
+        operations = parse_epd_operations(fields[4]) if len(fields) > 4 else {}
+        self.load_fen(" ".join(fields[:4]) + " " + operations.get("hmvc", "0") + " " + operations.get("fmvn", "1"))
+
+        return operations
+
+    # epd of the current position, with operations given as {opcode: operand string}
+    def get_epd(self, operations = None):
+        epd = self.get_epd_position()
+        for opcode, operand in (operations or {}).items():
+            epd += " " + opcode + (" " + operand if operand != "" else "") + ";"
+        return epd
+
+    # write a piece (or "--") to a square, keeping the bitboards, zobrist key and evaluation in sync
+    def set_square(self, row, col, piece):
+        sq = row * 8 + col
+        old_piece = self.board[row][col]
+        if old_piece != "--":
+            self.zobrist_key ^= zobrist.PIECE_KEYS[old_piece][sq]
+        if piece != "--":
+            self.zobrist_key ^= zobrist.PIECE_KEYS[piece][sq]
+
+        self.mg_score += evaluation.MG_SCORES[piece][sq] - evaluation.MG_SCORES[old_piece][sq]
+        self.eg_score += evaluation.EG_SCORES[piece][sq] - evaluation.EG_SCORES[old_piece][sq]
+        self.phase += evaluation.PHASE[piece] - evaluation.PHASE[old_piece]
+
+        if self.bitboards is not None:
+            self.bitboards.update_square(sq, old_piece, piece)
+        if self.nnue is not None:
+            self.nnue.update(sq, old_piece, piece)
+        self.board[row][col] = piece
+
+    # castling, enpassant and side to move part of the zobrist key
+    def state_key(self):
+        return zobrist.state_key(self.board, self.current_castling_rights, self.possible_enpassant, self.white_to_move)
 
     # execute move
     def make_move(self, move):
+        self.make_packed(move.packed)
+
+    # undo last move made (the move is taken from the move log, the argument is only kept for older callers)
+    def undo_move(self, move = None):
+        self.undo_packed()
 
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved    
-        self.move_log.append(move)
+    # execute a packed move
+    def make_packed(self, m):
 
-        # print(str(move.start_col) + str(move.start_row) + str(move.end_col) + str(move.end_row))
-        # print("Move made: " + move.get_chess_notation())
+        start_row, start_col = divmod(start_square(m), 8)
+        end_row, end_col = divmod(end_square(m), 8)
+        move_flag = flag(m)
 
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+        piece_moved = self.board[start_row][start_col]
+        if move_flag == ENPASSANT:
+            piece_captured = "bP" if piece_moved[0] == "w" else "wP"
+        else:
+            piece_captured = self.board[end_row][end_col]
+
+        # take the old castling/enpassant/turn state out of the key, pieces are handled by set_square
+        self.zobrist_key ^= self.state_key()
+
+        self.set_square(start_row, start_col, "--")
+        self.set_square(end_row, end_col, piece_moved)
+        self.move_log.append(m)
+        self.captured_log.append(piece_captured)
+
+        if piece_moved == "wK":
+            self.white_king_location = (end_row, end_col)
+        elif piece_moved == "bK":
+            self.black_king_location = (end_row, end_col)
     
         # if pawn promotion
-        if move.pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+        if move_flag == PROMOTION:
+            self.set_square(end_row, end_col, piece_moved[0] + promotion_piece(m))
 
         # if enpassant
-        if move.enpassant:
-            self.board[move.start_row][move.end_col] = "--" #capture
-
-        # enpassant only possible after two pawn move (set coordinates here)
-        if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-            self.possible_enpassant = ((move.start_row + move.end_row) // 2, move.end_col)
-        else:
-            self.possible_enpassant = ()
+        elif move_flag == ENPASSANT:
+            self.set_square(start_row, end_col, "--") #capture
 
         # if castle
-        if move.castle:
+        elif move_flag == CASTLE:
             
             # queen side
-            if move.start_col - move.end_col == 2:
+            if start_col - end_col == 2:
                 # move rook then erase it from old spot
-                self.board[move.start_row][move.end_col + 1] = "wR" if self.white_to_move else "bR"
-                self.board[move.start_row][move.end_col - 2] = "--"
+                self.set_square(start_row, end_col + 1, piece_moved[0] + "R")
+                self.set_square(start_row, end_col - 2, "--")
 
             # king side
-            elif move.end_col - move.start_col == 2:
+            elif end_col - start_col == 2:
                 # move rook then erase it from old spot
-                self.board[move.start_row][move.end_col - 1] = "wR" if self.white_to_move else "bR"
-                self.board[move.start_row][move.end_col + 1] = "--"
+                self.set_square(start_row, end_col - 1, piece_moved[0] + "R")
+                self.set_square(start_row, end_col + 1, "--")
+
+        # enpassant only possible after two pawn move (set coordinates here)
+        if piece_moved[1] == "P" and abs(start_row - end_row) == 2:
+            self.possible_enpassant = ((start_row + end_row) // 2, end_col)
+        else:
+            self.possible_enpassant = ()
+        self.enpassant_log.append(self.possible_enpassant)
+
+        # move counters
+        if piece_moved[1] == "P" or piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.halfmove_log.append(self.halfmove_clock)
+        if piece_moved[0] == "b":
+            self.fullmove_number += 1
                 
         # check castling rights, then append the new rights to the list in game state
-        self.check_castling_rights(move)
-        self.castle_rights_log.append(castling_rights(self.current_castling_rights.wks, self.current_castling_rights.wqs,
-                                                  self.current_castling_rights.bks, self.current_castling_rights.bqs))
+        self.check_castling_rights(piece_moved, piece_captured, start_row, start_col, end_row, end_col)
+        self.castle_rights_log.append(self.current_castling_rights.copy())
         
         # change turn
         self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= self.state_key()
 
-    # undo last move made
-    def undo_move(self, move):
+    # undo the last packed move
+    def undo_packed(self):
 
-        if(self.move_log != 0):
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured   
-            self.move_log.pop()
-            self.white_to_move = not self.white_to_move 
+        if len(self.move_log) != 0:
+            m = self.move_log.pop()
+            piece_captured = self.captured_log.pop()
+
+            start_row, start_col = divmod(start_square(m), 8)
+            end_row, end_col = divmod(end_square(m), 8)
+            move_flag = flag(m)
 
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            piece_moved = self.board[end_row][end_col]
+            if move_flag == PROMOTION:
+                piece_moved = piece_moved[0] + "P"
 
-            # enpassant
-            if move.enpassant:
-                self.board[move.end_row][move.end_col] == "--"
-                self.board[move.start_row][move.end_col] == move.piece_captured
-                self.possible_enpassant = (move.end_row, move.end_col)
+            self.zobrist_key ^= self.state_key()
+            self.set_square(start_row, start_col, piece_moved)
+            self.white_to_move = not self.white_to_move 
+
+            if piece_moved == "wK":
+                self.white_king_location = (start_row, start_col)
+            elif piece_moved == "bK":
+                self.black_king_location = (start_row, start_col)
 
-            # disable enpassant if undoing two square pawn move
-            if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-                self.possible_enpassant = ()
+            # enpassant (captured pawn sits beside the start square, not on the end square)
+            if move_flag == ENPASSANT:
+                self.set_square(end_row, end_col, "--")
+                self.set_square(start_row, end_col, piece_captured)
+            else:
+                self.set_square(end_row, end_col, piece_captured)
+
+            # castle (put the rook back in its corner)
+            if move_flag == CASTLE:
+                rook = piece_moved[0] + "R"
+                if start_col - end_col == 2:
+                    self.set_square(start_row, end_col + 1, "--")
+                    self.set_square(start_row, end_col - 2, rook)
+                elif end_col - start_col == 2:
+                    self.set_square(start_row, end_col - 1, "--")
+                    self.set_square(start_row, end_col + 1, rook)
+
+            # restore the enpassant square from before the move
+            self.enpassant_log.pop()
+            self.possible_enpassant = self.enpassant_log[-1]
+
+            self.halfmove_log.pop()
+            self.halfmove_clock = self.halfmove_log[-1]
+            if piece_moved[0] == "b":
+                self.fullmove_number -= 1
 
             # remove last castling rights, then reset flags in the castling rights log
             self.castle_rights_log.pop() 
-            self.current_castling_rights = self.castle_rights_log[-1]
+            self.current_castling_rights = self.castle_rights_log[-1].copy()
+
+            self.zobrist_key ^= self.state_key()
 
     # helper to check castling rights
-    def check_castling_rights(self, move):
+    def check_castling_rights(self, piece_moved, piece_captured, start_row, start_col, end_row, end_col):
         
-        if move.piece_moved == "wK":
+        if piece_moved == "wK":
             self.current_castling_rights.wks = False
             self.current_castling_rights.wqs = False
         
-        elif move.piece_moved == "bK":
+        elif piece_moved == "bK":
             self.current_castling_rights.bks = False
             self.current_castling_rights.bqs = False
 
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 0:
+        elif piece_moved == "wR":
+            if start_row == 7:
+                if start_col == 0:
                     self.current_castling_rights.wqs = False
-                elif move.start_col == 7:
+                elif start_col == 7:
                     self.current_castling_rights.wks = False
         
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 0:
+        elif piece_moved == "bR":
+            if start_row == 0:
+                if start_col == 0:
                     self.current_castling_rights.bqs = False
-                elif move.start_col == 7:
+                elif start_col == 7:
                     self.current_castling_rights.bks = False
 
+        # capturing a rook on its starting corner also removes that side's rights
+        if piece_captured == "wR" and end_row == 7:
+            if end_col == 0:
+                self.current_castling_rights.wqs = False
+            elif end_col == 7:
+                self.current_castling_rights.wks = False
+
+        elif piece_captured == "bR" and end_row == 0:
+            if end_col == 0:
+                self.current_castling_rights.bqs = False
+            elif end_col == 7:
+                self.current_castling_rights.bks = False
+
+    # add a packed pawn move, expanded into one move per promotion piece when it reaches the last row
+    def add_pawn_moves(self, moves, start, end):
+        if end < 8 or end >= 56:
+            for piece in ("Q", "N", "R", "B"):
+                moves.append(pack(start, end, PROMOTION, PROMOTION_INDEX[piece]))
+        else:
+            moves.append(pack(start, end))
+
     # helpers for getting moves for each piece 
     def get_pawn_moves(self, row, col, moves):
 
-        # checking for pinned condition
+        # checking for pinned condition (a pinned pawn can still move either way along the pin line)
         piece_pinned = False
         pin_direction = ()
 
@@ -160,6 +432,8 @@ class game_state():
                 break
 
         # can move one or two squares forward on first move, captures diagonally
+
+        sq = row * 8 + col
         
         # print(self.possible_enpassant)
 
@@ -169,10 +443,10 @@ class game_state():
             if row > 0:
                 # move forwards one and forwards two
                 if self.board[row - 1][col] == "--":
-                    if not piece_pinned or pin_direction == (-1, 0):
-                        moves.append(move((row, col), (row - 1,col), self.board))
+                    if not piece_pinned or pin_direction in ((-1, 0), (1, 0)):
+                        self.add_pawn_moves(moves, sq, sq - 8)
                         if row == 6 and self.board[row - 2][col] == "--":
-                                moves.append(move((row, col), (row - 2, col), self.board))
+                                moves.append(pack(sq, sq - 16))
                 
                 # capture diagonally
                 if col >= 0 and col <= (len(self.board) - 1):
@@ -180,27 +454,27 @@ class game_state():
                     if col > 0:
                         # regular left capture
                         if self.board[row - 1][col - 1][0] == "b":
-                            if not piece_pinned or pin_direction == (-1, -1):
-                                moves.append(move((row, col), (row - 1, col - 1), self.board))
+                            if not piece_pinned or pin_direction in ((-1, -1), (1, 1)):
+                                self.add_pawn_moves(moves, sq, sq - 9)
                         
                         # enpassant left capture
                         if self.board[row - 1][col - 1] == "--":
-                            if not piece_pinned or pin_direction == (-1, -1):
-                                if self.possible_enpassant == (row - 1, col - 1):   
+                            if not piece_pinned or pin_direction in ((-1, -1), (1, 1)):
+                                if self.possible_enpassant == (row - 1, col - 1) and self.enpassant_safe(row, col, row - 1, col - 1):   
                                     # print("enpassant possible!")
-                                    moves.append(move((row, col), (row - 1, col - 1), self.board, possible_enpassant = True))
+                                    moves.append(pack(sq, sq - 9, ENPASSANT))
                     
                     if col < 7:
                         # regular right capture
                         if self.board[row - 1][col + 1][0] == "b":
-                            if not piece_pinned or pin_direction == (-1, 1):
-                                moves.append(move((row, col), (row - 1, col + 1), self.board))
+                            if not piece_pinned or pin_direction in ((-1, 1), (1, -1)):
+                                self.add_pawn_moves(moves, sq, sq - 7)
                         
                         # enpassant right capture
                         if self.board[row - 1][col + 1] == "--":
-                            if not piece_pinned or pin_direction == (-1, 1):
-                                if self.possible_enpassant == (row - 1, col + 1):
-                                    moves.append(move((row, col), (row - 1, col + 1), self.board, possible_enpassant = True))
+                            if not piece_pinned or pin_direction in ((-1, 1), (1, -1)):
+                                if self.possible_enpassant == (row - 1, col + 1) and self.enpassant_safe(row, col, row - 1, col + 1):
+                                    moves.append(pack(sq, sq - 7, ENPASSANT))
 
         # black
         elif not self.white_to_move:
@@ -208,10 +482,10 @@ class game_state():
             if row < (len(self.board) - 1):
                 # move forwards one and forwards two
                 if self.board[row + 1][col] == "--":
-                    if not piece_pinned or pin_direction == (1, 0):
-                        moves.append(move((row, col), (row + 1, col), self.board))
+                    if not piece_pinned or pin_direction in ((-1, 0), (1, 0)):
+                        self.add_pawn_moves(moves, sq, sq + 8)
                         if row == 1 and self.board[row + 2][col] == "--":
-                                moves.append(move((row, col), (row + 2, col), self.board))
+                                moves.append(pack(sq, sq + 16))
 
                 # captures diagonally
                 if col >= 0 and col <= (len(self.board) - 1):
@@ -219,26 +493,43 @@ class game_state():
                     if col > 0:
                         # regular left capture  
                         if self.board[row + 1][col - 1][0] == "w":
-                            if not piece_pinned or pin_direction == (1, -1):
-                                moves.append(move((row, col), (row + 1, col - 1), self.board))
+                            if not piece_pinned or pin_direction in ((-1, 1), (1, -1)):
+                                self.add_pawn_moves(moves, sq, sq + 7)
                         
                         # enpassant left capture
                         if self.board[row + 1][col - 1] == "--":
-                            if not piece_pinned or pin_direction == (1, -1):
-                                if self.possible_enpassant == (row + 1, col - 1):
-                                    moves.append(move((row, col), (row + 1, col - 1), self.board, possible_enpassant = True))
+                            if not piece_pinned or pin_direction in ((-1, 1), (1, -1)):
+                                if self.possible_enpassant == (row + 1, col - 1) and self.enpassant_safe(row, col, row + 1, col - 1):
+                                    moves.append(pack(sq, sq + 7, ENPASSANT))
                     
                     if col < 7:
                         # regular right capture
                         if self.board[row + 1][col + 1][0] == "w":
-                            if not piece_pinned or pin_direction == (1, 1):
-                                moves.append(move((row, col), (row + 1, col + 1), self.board))
+                            if not piece_pinned or pin_direction in ((-1, -1), (1, 1)):
+                                self.add_pawn_moves(moves, sq, sq + 9)
                         
                         # enpassant right capture
                         if self.board[row + 1][col + 1] == "--":
-                            if not piece_pinned or pin_direction == (1, 1):
-                                if self.possible_enpassant == (row + 1, col + 1):
-                                    moves.append(move((row, col), (row + 1, col + 1), self.board, possible_enpassant = True))
+                            if not piece_pinned or pin_direction in ((-1, -1), (1, 1)):
+                                if self.possible_enpassant == (row + 1, col + 1) and self.enpassant_safe(row, col, row + 1, col + 1):
+                                    moves.append(pack(sq, sq + 9, ENPASSANT))
+
+    # enpassant takes two pawns off the same row, which a pin check can't see, so test the king after the capture
+    def enpassant_safe(self, row, col, end_row, end_col):
+        piece_moved = self.board[row][col]
+        piece_captured = self.board[row][end_col]
+
+        self.board[row][col] = "--"
+        self.board[row][end_col] = "--"
+        self.board[end_row][end_col] = piece_moved
+
+        in_check = self.check_pins_checks()[0]
+
+        self.board[end_row][end_col] = "--"
+        self.board[row][end_col] = piece_captured
+        self.board[row][col] = piece_moved
+
+        return not in_check
 
     def get_rook_moves(self, row, col, moves):
         
@@ -257,27 +548,22 @@ class game_state():
 
         # can move in straight line along files and ranks
 
-        directions = ((-1, 0), (1, 0), (0, -1), (0, 1))
         enemy = "b" if self.white_to_move else "w"
+        sq = row * 8 + col
 
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
+        for j in attack_tables.ROOK_RAYS:
+            d = attack_tables.DIRECTIONS[j]
+            if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
+                for end_row, end_col in attack_tables.RAY_SQUARES[j][sq]:
+                    end_piece = self.board[end_row][end_col]
 
-                        if end_piece == "--":
-                            moves.append(move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy:
-                            moves.append(move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
+                    if end_piece == "--":
+                        moves.append(pack(sq, end_row * 8 + end_col))
+                    elif end_piece[0] == enemy:
+                        moves.append(pack(sq, end_row * 8 + end_col))
+                        break
+                    else:
+                        break
 
     def get_knight_moves(self, row, col, moves):
         
@@ -290,20 +576,16 @@ class game_state():
                 # self.pins.remove(self.pins[i])
                 break
 
-        # can move in L shapes
+        # can move in L shapes (a pinned knight can never stay on the pin line)
 
-        directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
         ally = "w" if self.white_to_move else "b"
+        sq = row * 8 + col
 
-        for d in directions:
-            end_row = row + d[0]
-            end_col = col + d[1]
-
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally:
-                        moves.append(move((row, col) , (end_row, end_col), self.board))
+        if not piece_pinned:
+            for end_row, end_col in attack_tables.KNIGHT_SQUARES[sq]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece[0] != ally:
+                    moves.append(pack(sq, end_row * 8 + end_col))
 
     def get_bishop_moves(self, row, col, moves):
                
@@ -320,29 +602,22 @@ class game_state():
 
         # can move in straight line along diagonals
 
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
         enemy = "b" if self.white_to_move else "w"
-            
-        for d in directions:
-            for i in range(1, 8):
-                
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
+        sq = row * 8 + col
 
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
+        for j in attack_tables.BISHOP_RAYS:
+            d = attack_tables.DIRECTIONS[j]
+            if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
+                for end_row, end_col in attack_tables.RAY_SQUARES[j][sq]:
+                    end_piece = self.board[end_row][end_col] 
 
-                        end_piece = self.board[end_row][end_col] 
-
-                        if end_piece == "--":
-                            moves.append(move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy:
-                            moves.append(move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break   
+                    if end_piece == "--":
+                        moves.append(pack(sq, end_row * 8 + end_col))
+                    elif end_piece[0] == enemy:
+                        moves.append(pack(sq, end_row * 8 + end_col))
+                        break
+                    else:
+                        break
 
     def get_queen_moves(self, row, col, moves):
         self.get_bishop_moves(row, col, moves)
@@ -350,33 +625,28 @@ class game_state():
 
     def get_king_moves(self, row, col, moves):
         
-        row_directions = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_directions = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally = "w" if self.white_to_move else "b"
+        sq = row * 8 + col
 
-        for i in range(8):
-            end_row = row + row_directions[i] 
-            end_col = col + col_directions[i] 
+        for end_row, end_col in attack_tables.KING_SQUARES[sq]:
+            end_piece = self.board[end_row][end_col]
 
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-
-                if end_piece[0] != ally:
+            if end_piece[0] != ally:
 
-                    if ally == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
+                if ally == "w":
+                    self.white_king_location = (end_row, end_col)
+                else:
+                    self.black_king_location = (end_row, end_col)
 
-                    in_check, pins, checks = self.check_pins_checks()
+                in_check, pins, checks = self.check_pins_checks()
 
-                    if not in_check:
-                        moves.append(move((row, col), (end_row, end_col), self.board))
-                    
-                    if ally == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+                if not in_check:
+                    moves.append(pack(sq, end_row * 8 + end_col))
+                
+                if ally == "w":
+                    self.white_king_location = (row, col)
+                else:
+                    self.black_king_location = (row, col)
 
         self.get_castle_moves(row, col, moves, ally)
 
@@ -386,6 +656,8 @@ class game_state():
         # can't castle when in check
         if self.in_check:
             return
+
+        sq = row * 8 + col
         
         ''' 
         checking if blank squares are under attack
@@ -395,158 +667,74 @@ class game_state():
         side = 0
         if self.current_castling_rights.wks and ally == "w":
             if self.castle_checker(row, col, side, ally):
-                moves.append(move((row, col), (row, col + 2), self.board, possible_castle = True))
+                moves.append(pack(sq, sq + 2, CASTLE))
 
         if self.current_castling_rights.bks and ally == "b": 
             if self.castle_checker(row, col, side, ally):
-                moves.append(move((row, col), (row, col + 2), self.board, possible_castle = True))
+                moves.append(pack(sq, sq + 2, CASTLE))
 
         # queen side check
         side = 1
         if self.current_castling_rights.wqs and ally == "w":
             if self.castle_checker(row, col, side, ally):
-                moves.append(move((row, col), (row, col - 2), self.board, possible_castle = True))
+                moves.append(pack(sq, sq - 2, CASTLE))
 
         if self.current_castling_rights.bqs and ally == "b":
             if self.castle_checker(row, col, side, ally):
-                moves.append(move((row, col), (row, col - 2), self.board, possible_castle = True))
+                moves.append(pack(sq, sq - 2, CASTLE))
 
     # helper to check validity of intermediary squares between rook and king
     def castle_checker(self, row, col, side, ally):
 
-        if ally == "w":
-            enemy = "b"
-            directions = ((-1,-1), (-1, 0), (-1, 1))
-            king_row = self.white_king_location[0]
-            king_col = self.white_king_location[1]
-        else:
-            enemy = "w"
-            directions = ((1, -1), (1, 0), (1, 1))
-            king_row = self.black_king_location[0]
-            king_col = self.black_king_location[1]
-
-        # first check for empty squares
-        if side == 0:
-            if self.board[king_row][king_col + 1] != "--" or self.board[king_row][king_col + 2] != "--":
-                return False
-        elif side == 1:
-            if self.board[king_row][king_col - 1] != "--" or self.board[king_row][king_col - 2] != "--" or self.board[king_row][king_col - 3] != "--":
+        # squares between the king and rook must be empty
+        between = (col + 1, col + 2) if side == 0 else (col - 1, col - 2, col - 3)
+        for end_col in between:
+            if self.board[row][end_col] != "--":
                 return False
 
-        # now check to ensure that there are no checks crossing onto blank squares
-        for j in range(len(directions)):
-            d = directions[j]
-            continue_validation1 = True
-            continue_validation2 = True
-            continue_validation3 = True
+        # the king can't cross or land on an attacked square (tested like a king move, from that square)
+        for end_col in between[:2]:
+            if ally == "w":
+                self.white_king_location = (row, end_col)
+            else:
+                self.black_king_location = (row, end_col)
 
-            for i in range(1, 8):
-                
-                if side == 0:
-                    end_row = king_row + d[0] * i
-                    end_col1 = (king_col + 1) + d[1] * i
-                    end_col2 = (king_col + 2) + d[1] * i
-
-                    if 0 <= end_row < 8 and (0 <= end_col1 < 8 or 0 <= end_col2 < 8):
-                            
-                        if 0 <= end_col1 < 8 and continue_validation1:   
-                            end_piece1 = self.board[end_row][end_col1]
-                            # print("Enemy is " + enemy)
-
-                            # no longer need to continue looking for checking piece
-                            if end_piece1[0] == ally:
-                                continue_validation1 = False
-
-                            # is checking piece
-                            elif end_piece1[0] == enemy:
-                                piece = end_piece1[1]
-
-                                # possible cases for an attacking piece
-                                if (j == 1 and piece == "R") or \
-                                    ((j == 2 or j == 0) and piece == "B") or \
-                                    (i == 1 and piece == "P" and ((enemy == "w" and (j == 0 or j == 2)) or (enemy == "b" and (j == 0 or j == 2)))) or \
-                                    (piece == "Q") or (i == 1 and piece == "K"):
-                                    # print("Been put in check: ")
-                                    return False
-
-                                # print("Not in check")
-                        
-                        if 0 <= end_col2 < 8 and continue_validation2:
-                            end_piece2 = self.board[end_row][end_col2]
-                            # print("Enemy is " + enemy)
-                            
-                            # no longer need to continue looking for checking piece
-                            if end_piece2[0] == ally:
-                                continue_validation2 = False
-
-                            # is checking piece
-                            elif end_piece2[0] == enemy:
-                                piece = end_piece2[1]
-                            
-                                # possible cases for an attacking piece
-                                if (j == 1 and piece == "R") or \
-                                    ((j == 2 or j == 0) and piece == "B") or \
-                                    (i == 1 and piece == "P" and ((enemy == "w" and (j == 0 or j == 2)) or (enemy == "b" and (j == 0 or j == 2)))) or \
-                                    (piece == "Q") or (i == 1 and piece == "K"):
-                                    # print(self.current_castling_rights.wks)
-                                    # print("Been put in check: ")
-                                    return False
-
-                                # print("Not in check")
-                    
-                    else:
-                        break
-                
-                elif side == 1:
-                    end_row = king_row + d[0] * i
-                    end_col1 = (king_col - 1) + d[1] * i
-                    end_col2 = (king_col - 2) + d[1] * i
-
-                    if 0 <= end_row < 8 and (0 <= end_col1 < 8 or 0 <= end_col2 < 8):
-                            
-                        if 0 <= end_col1 < 8 and continue_validation1:   
-                            end_piece1 = self.board[end_row][end_col1]
-                            
-                            # no longer need to continue looking for checking piece
-                            if end_piece1[0] == ally:
-                                continue_validation1 = False
-
-                            # is checking piece
-                            elif end_piece1[0] == enemy:
-                                piece = end_piece1[1]
-                            
-                                # possible cases for an attacking piece
-                                if (j == 1 and piece == "R") or \
-                                    ((j == 2 or j == 0) and piece == "B") or \
-                                    (i == 1 and piece == "P" and ((enemy == "w" and (j == 0 or j == 2)) or (enemy == "b" and (j == 0 or j == 2)))) or \
-                                    (piece == "Q") or (i == 1 and piece == "K"):
-                                    return False
-
-                        if 0 <= end_col2 < 8 and continue_validation2:
-                            end_piece2 = self.board[end_row][end_col2]
-                            
-                            # no longer need to continue looking for checking piece
-                            if end_piece2[0] == ally:
-                                continue_validation2 = False
-
-                            # is checking piece
-                            elif end_piece2[0] == enemy:
-                                piece = end_piece2[1]
-                            
-                                # possible cases for an attacking piece
-                                if (j == 1 and piece == "R") or \
-                                    ((j == 2 or j == 0) and piece == "B") or \
-                                    (i == 1 and piece == "P" and ((enemy == "w" and (j == 0 or j == 2)) or (enemy == "b" and (j == 0 or j == 2)))) or \
-                                    (piece == "Q") or (i == 1 and piece == "K"):
-                                    return True
-                    
-                    else:
-                        break
+            in_check = self.check_pins_checks()[0]
+
+            if ally == "w":
+                self.white_king_location = (row, col)
+            else:
+                self.black_king_location = (row, col)
+
+            if in_check:
+                return False
 
         return True
 
-    # get all valid moves (when in check)
+    # get all valid moves (when in check), as move objects for the ui
     def valid_moves_checked(self):
+        return self.wrap_moves(self.valid_moves_packed())
+    
+    # get only captures, enpassant and promotions (and quiet checks if checks is set), for the quiescence search
+    def valid_captures_checked(self, checks = False):
+        return self.wrap_moves(self.valid_moves_packed(captures_only = True, checks = checks))
+
+    # get all valid moves as packed ints (see move_encoding), appended to moves so the caller can reuse a buffer
+    def valid_moves_packed(self, moves = None, captures_only = False, checks = False):
+
+        if moves is None:
+            moves = []
+
+        if self.bitboards is not None:
+            self.in_check = self.bitboards.in_check(self.white_to_move)
+            return self.bitboards.legal_moves(self.white_to_move, self.current_castling_rights, self.possible_enpassant,
+                                              moves, captures_only, checks)
+
+        moves.extend(self.list_valid_captures(checks) if captures_only else self.list_valid_moves())
+        return moves
+
+    # get all valid moves from the list generators (when in check), packed
+    def list_valid_moves(self):
         
         # enpassant
         temp_enpassant = self.possible_enpassant
@@ -574,7 +762,7 @@ class game_state():
                 moves = self.valid_moves()
                 
                 # block
-                valid_squares = [] #squares that can be occupied to block
+                valid_squares = set() #squares that can be occupied to block
                 check = self.checks[0]
                 check_row = check[0]
                 check_col = check[1]
@@ -583,21 +771,19 @@ class game_state():
 
                 # if knight, must capture knight (cannot block)
                 if checking_piece[1] == "N":
-                    valid_squares = [(check_row, check_col)]
+                    valid_squares.add(check_row * 8 + check_col)
                 
                 # go through to see which squares are valid to be able to block
                 else:
                     for i in range(1,8):
                         valid_square = (king_row + check[2] * i, king_col + check[3] * i)
-                        valid_squares.append(valid_square)
+                        valid_squares.add(valid_square[0] * 8 + valid_square[1])
                         if valid_square[0] == check_row and valid_square[1] == check_col:
                             break
                 
-                # remove moves that don't block check or move king location
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].piece_moved[1] != "K":
-                        if (moves[i].end_row, moves[i].end_col) not in valid_squares:
-                            moves.remove(moves[i])
+                # remove moves that don't block check or move king location (enpassant was already tested in full)
+                king_sq = king_row * 8 + king_col
+                moves = [m for m in moves if start_square(m) == king_sq or flag(m) == ENPASSANT or end_square(m) in valid_squares]
 
             # else two checks, must move king
             else:
@@ -610,7 +796,146 @@ class game_state():
         self.possible_enpassant = temp_enpassant
 
         return moves
-    
+
+    # get only captures, enpassant and promotions (and quiet checks if checks is set) from the list generators, packed
+    def list_valid_captures(self, checks = False):
+
+        # the list generators have no capture-only mode, so filter the full list
+        moves = []
+        for m in self.list_valid_moves():
+            end = end_square(m)
+            if self.board[end >> 3][end & 7] != "--" or flag(m) == PROMOTION or flag(m) == ENPASSANT:
+                moves.append(m)
+            elif checks and self.gives_check(m):
+                moves.append(m)
+
+        return moves
+
+    # the packed move m if it's legal here, with its flag put right (a move from a book doesn't know it's an enpassant),
+    # otherwise None, tests just the one move instead of generating every legal move
+    def legal_packed(self, m):
+
+        start = start_square(m)
+        end = end_square(m)
+        move_flag = flag(m)
+        start_row, start_col = divmod(start, 8)
+        end_row, end_col = divmod(end, 8)
+
+        ally = "w" if self.white_to_move else "b"
+        piece = self.board[start_row][start_col]
+        target = self.board[end_row][end_col]
+        if piece[0] != ally or target[0] == ally:
+            return None
+
+        # only a king can castle
+        if move_flag == CASTLE and piece[1] != "K":
+            return None
+
+        # pawns push onto an empty square (two from the start row) and capture diagonally, enpassant included
+        if piece[1] == "P":
+            forward = -1 if ally == "w" else 1
+            enpassant = False
+            if end_col == start_col:
+                if target != "--":
+                    return None
+                if end_row != start_row + forward and not (end_row == start_row + 2 * forward and
+                                                           start_row == (6 if ally == "w" else 1) and
+                                                           self.board[start_row + forward][start_col] == "--"):
+                    return None
+            elif abs(end_col - start_col) != 1 or end_row != start_row + forward:
+                return None
+            elif target == "--":
+                if self.possible_enpassant != (end_row, end_col):
+                    return None
+                enpassant = True
+
+            # a pawn reaching the last row has to say what it promotes to
+            if (end_row == 0 or end_row == 7) != (move_flag == PROMOTION):
+                return None
+            if move_flag == PROMOTION:
+                m = pack(start, end, PROMOTION, PROMOTION_INDEX[promotion_piece(m)])
+            else:
+                m = pack(start, end, ENPASSANT if enpassant else NORMAL)
+
+        elif move_flag == PROMOTION or move_flag == ENPASSANT:
+            return None
+
+        elif piece[1] == "N":
+            if not (attack_tables.KNIGHT_ATTACKS[start] >> end) & 1:
+                return None
+            m = pack(start, end)
+
+        # castling is checked like the generator does it, rights, rook, empty squares and no attacked ones
+        elif piece[1] == "K" and move_flag == CASTLE:
+            side = 0 if end_col > start_col else 1
+            rights = self.current_castling_rights
+            if ally == "w":
+                allowed = rights.wks if side == 0 else rights.wqs
+            else:
+                allowed = rights.bks if side == 0 else rights.bqs
+            home = (7 if ally == "w" else 0) * 8 + 4
+            if not allowed or start != home or end != (home + 2 if side == 0 else home - 2):
+                return None
+            if self.board[start_row][7 if side == 0 else 0] != ally + "R":
+                return None
+            if self.check_pins_checks()[0] or not self.castle_checker(start_row, start_col, side, ally):
+                return None
+            return pack(start, end, CASTLE)
+
+        elif piece[1] == "K":
+            if not (attack_tables.KING_ATTACKS[start] >> end) & 1:
+                return None
+            m = pack(start, end)
+
+        # sliders, along one of their rays with nothing in the way
+        else:
+            if piece[1] == "R":
+                rays = attack_tables.ROOK_RAYS
+            elif piece[1] == "B":
+                rays = attack_tables.BISHOP_RAYS
+            else:
+                rays = attack_tables.ROOK_RAYS + attack_tables.BISHOP_RAYS
+            for j in rays:
+                if (attack_tables.RAYS[j][start] >> end) & 1:
+                    break
+            else:
+                return None
+            for row, col in attack_tables.RAY_SQUARES[j][start]:
+                if row == end_row and col == end_col:
+                    break
+                if self.board[row][col] != "--":
+                    return None
+            m = pack(start, end)
+
+        # the move can't leave our own king in check
+        self.make_packed(m)
+        self.white_to_move = not self.white_to_move
+        in_check = self.check_pins_checks()[0]
+        self.white_to_move = not self.white_to_move
+        self.undo_packed()
+        return None if in_check else m
+
+    # does this packed move put the opponent in check
+    def gives_check(self, m):
+        self.make_packed(m)
+        in_check = self.check_pins_checks()[0]
+        self.undo_packed()
+        return in_check
+
+    # wrap packed moves in move objects, reading the pieces off the board before any of them is made
+    def wrap_moves(self, packed):
+
+        # the bitboard generator doesn't track pins and checks
+        if self.bitboards is not None:
+            self.pins = []
+            self.checks = []
+
+        moves = []
+        for m in packed:
+            moves.append(move_from_packed(m, self.board))
+
+        return moves
+
     # get all valid moves
     def valid_moves(self):
         moves = []
@@ -644,55 +969,47 @@ class game_state():
             king_col = self.black_king_location[1]
  
         # check outward in all eight directions for pins and checks
-        directions = ((-1, 0), (0, -1), (0, 1), (1, 0), (-1,-1), (-1, 1), (1, 1), (1, -1))
+        king_sq = king_row * 8 + king_col
         
-        for j in range(len(directions)):
-            d = directions[j]
+        for j in range(len(attack_tables.DIRECTIONS)):
+            d = attack_tables.DIRECTIONS[j]
             possible_pin = ()
-            for i in range(1, 8):
-                end_row = king_row + d[0] * i
-                end_col = king_col + d[1] * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
+            i = 0
+            for end_row, end_col in attack_tables.RAY_SQUARES[j][king_sq]:
+                i += 1
+                end_piece = self.board[end_row][end_col]
 
-                    # possible pin
-                    if end_piece[0] == ally and end_piece[1] != "K":
+                # possible pin
+                if end_piece[0] == ally and end_piece[1] != "K":
+                    if possible_pin == ():
+                        # save the location of the pin and the direction to the king
+                        possible_pin = (end_row, end_col, d[0], d[1])
+                    else:
+                        break
+                
+                # checking piece
+                elif end_piece[0] == enemy:
+                    piece = end_piece[1]
+                    # possible cases for an attacking piece
+                    if (0 <= j <= 3 and piece == "R") or \
+                        (4 <= j <= 7 and piece == "B") or \
+                        (i == 1 and piece == "P" and ((enemy == "b" and 4 <= j <= 5) or (enemy == "w" and 6 <= j <=7))) or \
+                        (piece == "Q") or (i == 1 and piece == "K"):
                         if possible_pin == ():
-                            # save the location of the pin and the direction to the king
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else:
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
                             break
-                    
-                    # checking piece
-                    elif end_piece[0] == enemy:
-                        piece = end_piece[1]
-                        # possible cases for an attacking piece
-                        if (0 <= j <= 3 and piece == "R") or \
-                            (4 <= j <= 7 and piece == "B") or \
-                            (i == 1 and piece == "P" and ((enemy == "b" and 4 <= j <= 5) or (enemy == "w" and 6 <= j <=7))) or \
-                            (piece == "Q") or (i == 1 and piece == "K"):
-                            if possible_pin == ():
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possible_pin)
-                                break
                         else:
+                            pins.append(possible_pin)
                             break
-                else:
-                    break
+                    else:
+                        break
 
-        knight_directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for k in knight_directions:
-            end_row = king_row + k[0]
-            end_col = king_col + k[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy and end_piece[1] == "N":
-                    in_check = True
-                    checks.append((end_row, end_col, k[0], k[1]))
+        for end_row, end_col in attack_tables.KNIGHT_SQUARES[king_sq]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] == enemy and end_piece[1] == "N":
+                in_check = True
+                checks.append((end_row, end_col, end_row - king_row, end_col - king_col))
         
         # print("Check status from helper method: " + str(in_check))
         return in_check, pins, checks
@@ -705,8 +1022,8 @@ class move():
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    # constructor
-    def __init__(self, start_pos, end_pos, board, possible_enpassant = False, possible_castle = False):
+    # constructor (a view over a packed move, see move_encoding, with the pieces read off the board for the ui)
+    def __init__(self, start_pos, end_pos, board, possible_enpassant = False, possible_castle = False, promotion_piece = "Q"):
         
         # coordinates for start and end positions
         self.start_row = start_pos[0]
@@ -720,6 +1037,7 @@ class move():
 
         # pawn promotion
         self.pawn_promotion = (self.piece_moved == "wP" and self.end_row == 0) or (self.piece_moved == "bP" and self.end_row == 7)
+        self.promotion_piece = promotion_piece if self.pawn_promotion else None
 
         # enpassant
         self.enpassant = possible_enpassant
@@ -730,13 +1048,26 @@ class move():
         # castling
         self.castle = possible_castle
 
-        # move id
-        self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        # packed move
+        if self.pawn_promotion:
+            self.packed = pack(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col, PROMOTION,
+                               PROMOTION_INDEX[promotion_piece])
+        elif self.enpassant:
+            self.packed = pack(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col, ENPASSANT)
+        elif self.castle:
+            self.packed = pack(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col, CASTLE)
+        else:
+            self.packed = pack(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col)
+
+        # move id (ignores the flag, since a clicked move doesn't know it's an enpassant or castle)
+        self.move_id = self.packed & MATCH_MASK
  
-    # not actually chess notation
+    # not actually chess notation (long algebraic, as used by uci)
     def get_chess_notation(self):
-        return str(self.get_rank_file(self.start_row, self.start_col)) + str(self.get_rank_file(self.end_row, self.end_col))
-        # return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        notation = str(self.get_rank_file(self.start_row, self.start_col)) + str(self.get_rank_file(self.end_row, self.end_col))
+        if self.pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     # get coordinates
     def get_rank_file(self, row, col):
@@ -751,6 +1082,75 @@ class move():
             else:
                  return False
 
+# a position's valid moves indexed for the ui, by start square and by (start, end) pair, built once per position
+# (a pawn reaching the last row has one move per promotion piece under the same pair)
+class move_index():
+
+    # constructor (moves is the position's valid_moves_checked list)
+    def __init__(self, moves):
+        self.moves = moves
+        self.from_square = {}
+        self.from_to = {}
+        for player_move in moves:
+            start = (player_move.start_row, player_move.start_col)
+            end = (player_move.end_row, player_move.end_col)
+            self.from_square.setdefault(start, []).append(player_move)
+            self.from_to.setdefault((start, end), {})[player_move.promotion_piece] = player_move
+
+    # moves of the piece on start
+    def moves_from(self, start):
+        return self.from_square.get(start, [])
+
+    # squares the piece on start can move to
+    def destinations(self, start):
+        return {(player_move.end_row, player_move.end_col) for player_move in self.moves_from(start)}
+
+    # does start to end need a promotion piece picked
+    def is_promotion(self, start, end):
+        choices = self.from_to.get((start, end))
+        return choices is not None and None not in choices
+
+    # the valid move from start to end, or None (promotion is the piece for a pawn reaching the last row)
+    def find(self, start, end, promotion = "Q"):
+        choices = self.from_to.get((start, end))
+        if choices is None:
+            return None
+        return choices.get(None if None in choices else promotion)
+
+# build a move object from a packed move, reading the pieces off the board before it's made
+def move_from_packed(m, board):
+    move_flag = flag(m)
+    return move(divmod(start_square(m), 8), divmod(end_square(m), 8), board, possible_enpassant = move_flag == ENPASSANT,
+                possible_castle = move_flag == CASTLE, promotion_piece = promotion_piece(m))
+
+# split the operations part of an epd line into {opcode: operand string}, quotes kept on string operands
+def parse_epd_operations(text):
+
+    operations = {}
+    i = 0
+    while i < len(text):
+        # skip to the next opcode
+        while i < len(text) and text[i] in " ;":
+            i += 1
+        start = i
+        while i < len(text) and text[i] not in " ;":
+            i += 1
+        opcode = text[start:i]
+        if not opcode:
+            break
+
+        # operands run to the next semicolon outside of a quoted string
+        start = i
+        quoted = False
+        while i < len(text) and (quoted or text[i] != ";"):
+            if text[i] == '"':
+                quoted = not quoted
+            i += 1
+        operations[opcode] = text[start:i].strip()
+        i += 1
+
+    return operations
+
 class castling_rights():
 
     # constructor
@@ -758,4 +1158,7 @@ class castling_rights():
         self.wks = wks
         self.wqs = wqs
         self.bks = bks
-        self.bqs = bqs
\ No newline at end of file
+        self.bqs = bqs
+
+    def copy(self):
+        return castling_rights(self.wks, self.bks, self.wqs, self.bqs)
\ No newline at end of file
@@ -3,14 +3,18 @@
 import pygame as p 
 import chess_engine
 import ai
-import chess
-import chess.polyglot
+import game_log
+from move_encoding import start_square, end_square
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15 # for animations
+MAX_FPS = 15 # redraw rate while the ai is thinking, otherwise the loop sleeps until the next event
+PONDER = True # keep the ai searching its predicted reply while the human thinks (for up to ai.PONDER_TIME_LIMIT)
+LOG_LEVEL = None # logging.INFO to log each move to stdout, logging.DEBUG for the board after it too (see game_log)
 IMAGES = {} # dict for piece images
+HIGHLIGHTS = {"selected": (70, 130, 180), "destination": (100, 170, 100), "last_move": (205, 210, 60)} # square colours
+PROMOTION_KEYS = {p.K_q: "Q", p.K_r: "R", p.K_b: "B", p.K_n: "N"} # keys that pick the piece for a promotion click
 
 # init a global dict of images at the beginning of the game
 def load_images():
@@ -20,45 +24,69 @@ def load_images():
     
 # main driver to handle user input and update the drawn board
 def main():
+    if LOG_LEVEL is not None:
+        game_log.enable(LOG_LEVEL)
+
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
-    clock = p.time.Clock()
     screen.fill(p.Color("white"))
 
+    # the loop wakes for clicks, keys and window events, not for every mouse movement
+    p.event.set_blocked(p.MOUSEMOTION)
+
     # construct board
     gs = chess_engine.game_state()
 
-    # get valid moves
+    # get valid moves, indexed by square for the clicks and highlights
     valid_moves = gs.valid_moves_checked()
+    index = chess_engine.move_index(valid_moves)
     
     # flags when a valid move has been made, then generate a new set of valid_moves
     move_made = False 
 
     # print(gs.board)
     load_images()
+    renderer = board_renderer(screen)
     running = True
 
     # move
     initial_selection = ()
     final_selection = []
+    promotion_pending = None # (start, end) of a promotion click waiting for its piece key
 
     # detect if ai chosen (false for ai)
     player_one = True
     player_two = False
 
-    board = chess.Board()
-    print(board)
-    print("--------------------------------------------------------------------------------")
+    # ai search running in the background, polled every frame, and the ponder search started after each ai move
+    thinking = None
+    pondering = None
+    font = p.font.SysFont("Arial", 14, True)
+
+    game_log.log_board(gs)
 
     while running:
 
         human_turn = (player_one and gs.white_to_move) or (player_two and not gs.white_to_move)
+        human_move = None
+
+        # sleep until the next event, except to start the ai's search and to poll it at MAX_FPS while it runs
+        if not human_turn and len(valid_moves) > 0:
+            timeout = 1000 // MAX_FPS if thinking is not None else 0
+        else:
+            timeout = -1
 
         # event monitor
-        for event in p.event.get():
+        for event in next_events(timeout):
 
             if event.type == p.QUIT:
                 running = False
+                if thinking is not None:
+                    thinking.stop()
+                    thinking = None
+                if pondering is not None:
+                    pondering.stop()
+                    pondering = None
 
             # mouse presses
             elif event.type == p.MOUSEBUTTONDOWN:
@@ -68,6 +96,9 @@ def main():
                     location = p.mouse.get_pos()
                     col = location[0] // SQ_SIZE
                     row = location[1] // SQ_SIZE
+
+                    # a click while a promotion piece is being picked cancels the promotion
+                    promotion_pending = None
                     
                     # if first click is same as most recent click then its a deselect
                     if initial_selection == (row, col):
@@ -79,66 +110,188 @@ def main():
                         initial_selection = (row, col)
                         final_selection.append(initial_selection)
                     
-                    # if most recent click diff than first click, its a move
+                    # if most recent click diff than first click, its a move (a promotion waits for its piece key)
                     if(len(final_selection) == 2):
-                        
-                        move = chess_engine.move(final_selection[0], final_selection[1], gs.board)
-
-                        # print(move.get_chess_notation())
-                        
-                        for i in range(len(valid_moves)):
-                            if move == valid_moves[i]:
-                                move_made = True
-                                # print(move.move_id)
-                                gs.make_move(valid_moves[i])
-
-                                # reset clicks
-                                initial_selection = ()
-                                final_selection = []
-
-                                move_played_string = valid_moves[i].get_chess_notation()
-                                board.push(chess.Move.from_uci(move_played_string))
-                        
-                        if not move_made:
-                            final_selection = [initial_selection]
+
+                        if index.is_promotion(final_selection[0], final_selection[1]):
+                            promotion_pending = (final_selection[0], final_selection[1])
+                        else:
+                            human_move = index.find(final_selection[0], final_selection[1])
+                            if human_move is None:
+                                final_selection = [initial_selection]
+
+                    # only a piece that can move can be selected
+                    if len(final_selection) == 1 and not index.moves_from(final_selection[0]):
+                        initial_selection = ()
+                        final_selection = []
+
+            # the window was uncovered, its contents are gone
+            elif event.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                renderer.full = True
 
             # key presses
             elif event.type == p.KEYDOWN:
 
                 # undo
                 if event.key == p.K_z:
-                    gs.undo_move(move)
+
+                    # throw away a search of the position being undone
+                    if thinking is not None:
+                        thinking.stop()
+                        thinking = None
+                    if pondering is not None:
+                        pondering.stop()
+                        pondering = None
+
+                    gs.undo_move()
                     move_made = True
+                    game_log.logger.info("move undone")
+                    game_log.log_board(gs)
 
                     # reset clicks
                     initial_selection = ()
                     final_selection = []
+                    promotion_pending = None
                 
-                # pawn promotion
-                
-                # if event.key == p.K_q:
-                # elif event.key == p.K_n:
-                # elif event.key == p.K_b:
-                # elif event.key == p.K_r:
-
-        # ai move 
-        if not human_turn:
-            ai_move = ai.find_better_move(valid_moves, gs)
-            gs.make_move(ai_move)
+                # pawn promotion, the piece for the pending promotion click
+                elif promotion_pending is not None and event.key in PROMOTION_KEYS:
+                    human_move = index.find(promotion_pending[0], promotion_pending[1], PROMOTION_KEYS[event.key])
+                    promotion_pending = None
+
+        # human move
+        if human_move is not None:
+            gs.make_move(human_move)
             move_made = True
 
+            # reset clicks
+            initial_selection = ()
+            final_selection = []
+
+            game_log.log_move(gs, human_move, "human")
+
+            # the predicted reply: the ponder search becomes the ai's search, otherwise it's dropped
+            if pondering is not None:
+                if pondering.ponder_move == human_move.packed:
+                    pondering.ponder_hit()
+                    thinking = pondering
+                else:
+                    pondering.stop()
+                pondering = None
+
+        # ai move, searched on a worker thread so the window keeps drawing and handling events
+        if running and not human_turn and not move_made and len(valid_moves) > 0:
+            if thinking is None:
+                thinking = ai.background_search(gs)
+            elif thinking.done():
+                best_move = thinking.best_move()
+                pv = thinking.result[2]
+                thinking = None
+                for ai_move in valid_moves:
+                    if ai_move.packed == best_move:
+                        gs.make_move(ai_move)
+                        move_made = True
+                        game_log.log_move(gs, ai_move, "ai")
+                        break
+
+                # ponder the reply the search expects, if it's the human's turn next
+                if PONDER and move_made and len(pv) > 1 and \
+                        ((player_one and gs.white_to_move) or (player_two and not gs.white_to_move)):
+                    pondering = ai.background_search(gs, ponder_move = pv[1].packed)
+
         if(move_made):
             move_made = False
             valid_moves = gs.valid_moves_checked()
+            index = chess_engine.move_index(valid_moves)
+
+        # highlight the selected square and the last move's squares
+        highlights = {}
+        if len(gs.move_log) > 0:
+            last_move = gs.move_log[-1]
+            highlights[divmod(start_square(last_move), 8)] = "last_move"
+            highlights[divmod(end_square(last_move), 8)] = "last_move"
+        if initial_selection:
+            for square in index.destinations(initial_selection):
+                highlights[square] = "destination"
+            highlights[initial_selection] = "selected"
+
+        # message box: the promotion choice, or the ai's progress
+        if promotion_pending is not None:
+            message = "promote to:  q  r  b  n"
+        elif thinking is not None:
+            message = "thinking...  depth " + str(thinking.info.depth) + "  " + str(thinking.info.nps() // 1000) + "k nps"
+        else:
+            message = None
+
+        # push only the squares that changed to the window
+        dirty = renderer.draw(gs.board, highlights, font, message)
+        if dirty:
+            p.display.update(dirty)
+
+# block until the next event (up to timeout ms, 0 doesn't wait, -1 waits for good), then take everything queued
+def next_events(timeout):
+    if timeout != 0:
+        event = p.event.wait(timeout) if timeout > 0 else p.event.wait()
+        if event.type != p.NOEVENT:
+            return [event] + p.event.get()
+    return p.event.get()
+
+# draws the board, redrawing only the squares whose piece or highlight changed since the last frame
+# the squares are drawn once to a background surface, and each changed square is copied from it before its piece goes on
+class board_renderer():
 
-        draw_game_state(screen, gs)    
-        clock.tick(MAX_FPS)
-        p.display.flip()
+    # constructor
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = p.Surface((WIDTH, HEIGHT))
+        draw_squares(self.background)
+        self.overlays = {}
+        for name, colour in HIGHLIGHTS.items():
+            self.overlays[name] = p.Surface((SQ_SIZE, SQ_SIZE))
+            self.overlays[name].fill(colour)
+            self.overlays[name].set_alpha(110)
+        self.drawn = {} # (row, col) -> (piece, highlight) as it was last drawn
+        self.indicator = None # rect the message box was last drawn in
+        self.full = True # redraw everything on the next frame
 
-# graphics for current game state
-def draw_game_state(screen, gs):
-    draw_squares(screen) 
-    draw_pieces(screen, gs.board)
+    # draw the frame, returns the rects that changed (to give display.update)
+    def draw(self, board, highlights, font = None, message = None):
+
+        dirty = []
+        if self.full:
+            self.full = False
+            self.drawn = {}
+            dirty.append(self.screen.get_rect())
+
+        # squares under last frame's message box have to be put back
+        if self.indicator is not None:
+            for row, col in list(self.drawn):
+                if self.indicator.colliderect(p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)):
+                    del self.drawn[(row, col)]
+            dirty.append(self.indicator)
+            self.indicator = None
+
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                state = (board[row][col], highlights.get((row, col)))
+                if self.drawn.get((row, col)) != state:
+                    self.drawn[(row, col)] = state
+                    dirty.append(self.draw_square(row, col, *state))
+
+        if message is not None:
+            self.indicator = draw_message(self.screen, font, message)
+            dirty.append(self.indicator)
+
+        return dirty
+
+    # one square: background, highlight, piece, returns its rect
+    def draw_square(self, row, col, piece, highlight):
+        rect = p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.overlays[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
 
 # helper for graphics (squares)
 def draw_squares(screen):
@@ -153,14 +306,13 @@ def draw_squares(screen):
                 colour = grey # colour grey
             p.draw.rect(screen, colour, p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-# helper for graphics (pieces)
-def draw_pieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if(piece != "--"):
-                # look up blit usage after
-                screen.blit(IMAGES[piece], p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)) 
+# helper for graphics (message box in the corner, e.g. the ai's live depth and speed), returns the rect it covers
+def draw_message(screen, font, message):
+    text = font.render(message, True, p.Color("white"))
+    box = p.Rect(4, 4, text.get_width() + 12, text.get_height() + 8)
+    p.draw.rect(screen, p.Color("black"), box)
+    screen.blit(text, (box.x + 6, box.y + 4))
+    return box
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
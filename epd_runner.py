@@ -0,0 +1,162 @@
+# batch runner: search every position of an epd file with the ai, spread over a process pool
+# results stream out as one json object per line (written as positions finish, not in file order), and a rerun
+# with the same output file skips the positions already in it, so an interrupted sweep picks up where it stopped
+#
+# usage: python epd_runner.py positions.epd -o results.jsonl [--depth N] [--time SECONDS] [--nodes N] [--workers N]
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ai
+import book_builder
+import chess_engine
+from move_encoding import to_uci
+
+BATCH = 8 # positions per job, so the pool isn't flooded with tiny tasks
+DEPTH = 4 # used when no budget is given
+
+# epd lines worth searching, as (index, line) with index counting from 0 over the whole file
+def read_positions(path):
+    positions = []
+    with open(path, encoding = "utf-8", errors = "replace") as epd:
+        for index, line in enumerate(epd):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                positions.append((index, line))
+    return positions
+
+# indexes already written to an earlier run's output
+def finished_positions(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding = "utf-8") as results:
+            for line in results:
+                try:
+                    done.add(json.loads(line)["index"])
+                except (ValueError, KeyError):
+                    pass # a line cut off by the interruption
+    return done
+
+# worker setup, each process gets its own transposition table (emptied again for every position, see search_position)
+def start_worker(hash_mb):
+    ai.set_hash_size(hash_mb)
+
+# search one epd position, returns its result dict
+def search_position(index, line, max_depth, time_limit, max_nodes):
+
+    gs = chess_engine.game_state("bitboard")
+    result = {"index": index, "epd": line}
+
+    try:
+        operations = gs.load_epd(line)
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+
+    if "id" in operations:
+        result["id"] = operations["id"].strip('"')
+
+    # a fresh table, so the result doesn't depend on which positions this worker searched before
+    ai.set_hash_size(*ai.hash_settings)
+
+    info = ai.search_info()
+    start = time.time()
+    best_move, score, pv = ai.search(gs, max_depth, time_limit, max_nodes, info)
+    elapsed = time.time() - start
+
+    result["best_move"] = best_move.get_chess_notation() if best_move is not None else None
+    result["score"] = score
+    result["depth"] = info.depth
+    result["nodes"] = info.nodes
+    result["time"] = round(elapsed, 4)
+    result["pv"] = [player_move.get_chess_notation() for player_move in pv]
+
+    # test suite positions: did the search find a best move (bm) and avoid the ones to avoid (am)
+    moves = gs.valid_moves_packed()
+    for opcode in ("bm", "am"):
+        if opcode in operations and best_move is not None:
+            expected = [book_builder.parse_san(gs, san, moves) for san in operations[opcode].split()]
+            expected = [to_uci(m) for m in expected if m is not None]
+            result[opcode] = expected
+            solved = (result["best_move"] in expected) == (opcode == "bm")
+            result["solved"] = result.get("solved", True) and solved
+
+    return result
+
+def search_batch(batch, max_depth, time_limit, max_nodes):
+    return [search_position(index, line, max_depth, time_limit, max_nodes) for index, line in batch]
+
+# run a whole file, appending results to output, returns the number of positions searched this run
+def run(epd_path, output, max_depth = None, time_limit = None, max_nodes = None, workers = None,
+        hash_mb = ai.HASH_MB, batch_size = BATCH, progress = sys.stderr):
+
+    if max_depth is None and time_limit is None and max_nodes is None:
+        max_depth = DEPTH
+    if max_depth is None:
+        max_depth = ai.MAX_DEPTH
+
+    positions = read_positions(epd_path)
+    done = finished_positions(output)
+    todo = [position for position in positions if position[0] not in done]
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+
+    total = len(positions)
+    finished = len(positions) - len(todo)
+    searched = 0
+    nodes = 0
+    start = time.time()
+
+    # an interrupted write can leave a partial last line, so start on a fresh one
+    if os.path.exists(output) and os.path.getsize(output) > 0:
+        with open(output, "rb+") as results:
+            results.seek(-1, os.SEEK_END)
+            if results.read(1) != b"\n":
+                results.write(b"\n")
+
+    with open(output, "a", encoding = "utf-8") as results, \
+            ProcessPoolExecutor(workers, initializer = start_worker, initargs = (hash_mb,)) as pool:
+
+        futures = [pool.submit(search_batch, batch, max_depth, time_limit, max_nodes) for batch in batches]
+        for future in as_completed(futures):
+            for result in future.result():
+                results.write(json.dumps(result) + "\n")
+                searched += 1
+                nodes += result.get("nodes", 0)
+            results.flush()
+
+            finished = len(positions) - len(todo) + searched
+            if progress is not None:
+                elapsed = time.time() - start
+                rate = searched / elapsed if elapsed > 0 else 0
+                eta = (total - finished) / rate if rate > 0 else 0
+                progress.write("\r{}/{} positions  {:.1f}/s  {:.0f} nps  eta {:.0f}s   ".format(
+                    finished, total, rate, nodes / elapsed if elapsed > 0 else 0, eta))
+                progress.flush()
+
+    if progress is not None:
+        progress.write("\n")
+
+    return searched
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "search every position of an epd file in parallel")
+    parser.add_argument("epd", help = "epd file to run")
+    parser.add_argument("-o", "--output", required = True, help = "jsonl results (appended to, and resumed from)")
+    parser.add_argument("--depth", type = int, help = "search depth per position")
+    parser.add_argument("--time", type = float, help = "seconds per position")
+    parser.add_argument("--nodes", type = int, help = "nodes per position")
+    parser.add_argument("--workers", type = int, help = "worker processes (default: all cores)")
+    parser.add_argument("--hash", type = int, default = ai.HASH_MB, help = "transposition table MB per worker")
+    parser.add_argument("--batch", type = int, default = BATCH, help = "positions per job")
+    parser.add_argument("--quiet", action = "store_true", help = "no progress line")
+    args = parser.parse_args(argv)
+
+    run(args.epd, args.output, args.depth, args.time, args.nodes, args.workers, args.hash, args.batch,
+        None if args.quiet else sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
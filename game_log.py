@@ -0,0 +1,35 @@
+# optional levelled logging for the gui and the ai, off unless enable() is called (see LOG_LEVEL in chess_main)
+# moves are logged at info, the board after each move at debug, nothing is formatted while the level is off
+
+import logging
+import sys
+
+logger = logging.getLogger("chess_ai")
+logger.addHandler(logging.NullHandler())
+
+SEPARATOR = "-" * 80
+
+# turn logging on at level (logging.INFO for moves, logging.DEBUG for moves and boards)
+def enable(level = logging.INFO, stream = None):
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+# text board, white pieces in capitals, black in lower case, rank 8 first
+def board_text(board):
+    rows = []
+    for row in board:
+        rows.append(" ".join("." if piece == "--" else (piece[1] if piece[0] == "w" else piece[1].lower())
+                             for piece in row))
+    return "\n".join(rows)
+
+# log a move (as source, e.g. "human", "ai" or "book") and then the board it left
+def log_move(gs, player_move, source):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s move made: %s", source, player_move.get_chess_notation())
+    log_board(gs)
+
+def log_board(gs):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s\n%s", board_text(gs.board), SEPARATOR)
@@ -0,0 +1,328 @@
+# headless self-play: plays games between two ai settings in worker processes, no pygame and no frame rate
+# each opening (random book lines, or the positions of an epd file) is played twice with the colours swapped
+# games are adjudicated on checkmate, stalemate, the 50-move rule, threefold repetition and bare material
+# finished games are appended to a pgn file, and a summary of the score, per-move latency and nps is printed
+#
+# usage: python match_runner.py --games 20 --one depth=4 --two time=0.2,eval=pst -o games.pgn
+#        [--epd openings.epd | --book-plies 8] [--workers N] [--max-plies 300] [--seed N]
+# a player is comma separated key=value pairs: depth, time (seconds), nodes, eval (pst or nnue), network (nnue file,
+# default nnue.NETWORK_PATH), hash (MB), name
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ai
+import book_builder
+import chess_engine
+import epd_runner
+import nnue
+import polyglot_book
+import transposition
+from move_encoding import to_uci
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+GAMES = 10
+BOOK_PLIES = 8
+MAX_PLIES = 300 # a game still going after this many plies is stopped unfinished
+DEPTH = 3 # used when a player has no budget
+
+PLAYER_KEYS = {"depth": int, "time": float, "nodes": int, "eval": str, "network": str, "hash": int, "name": str}
+
+# player settings from "depth=4,time=0.5,eval=pst"
+def parse_player(text, name = None):
+
+    player = {"depth": None, "time": None, "nodes": None, "eval": "pst", "network": None, "hash": ai.HASH_MB,
+              "name": name}
+    for pair in text.split(","):
+        if not pair:
+            continue
+        key, equals, value = pair.partition("=")
+        if key not in PLAYER_KEYS or not equals:
+            raise argparse.ArgumentTypeError("bad player setting: " + pair)
+        try:
+            player[key] = PLAYER_KEYS[key](value)
+        except ValueError:
+            raise argparse.ArgumentTypeError("bad value for " + key + ": " + value)
+
+    if player["eval"] not in ("pst", "nnue"):
+        raise argparse.ArgumentTypeError("unknown eval: " + player["eval"])
+
+    # catch a missing network here rather than in every worker
+    if player["eval"] == "nnue" and not os.path.exists(player["network"] or nnue.NETWORK_PATH):
+        raise argparse.ArgumentTypeError("nnue network not found: " + (player["network"] or nnue.NETWORK_PATH) +
+                                         " (give one with network=PATH)")
+
+    if player["depth"] is None and player["time"] is None and player["nodes"] is None:
+        player["depth"] = DEPTH
+    if player["name"] is None:
+        player["name"] = text or "depth=" + str(DEPTH)
+    return player
+
+# openings as (fen, uci moves), from an epd file (in file order) or random lines out of the merged book
+# (random legal moves, with a warning, when the book can't be opened, so the openings still differ)
+def read_openings(count, epd_path = None, book_plies = BOOK_PLIES, seed = None):
+
+    if epd_path is not None:
+        openings = []
+        for index, line in epd_runner.read_positions(epd_path):
+            gs = chess_engine.game_state("bitboard")
+            try:
+                gs.load_epd(line)
+            except ValueError:
+                continue
+            openings.append((gs.get_fen(), []))
+        return openings[:count]
+
+    try:
+        book = polyglot_book.open_merged()
+    except (OSError, ValueError) as error:
+        sys.stderr.write("warning: no opening book (" + str(error) + "), openings are random moves\n")
+        book = None
+
+    rng = random.Random(seed)
+    openings = []
+    for i in range(count):
+        gs = chess_engine.game_state("bitboard")
+        moves = []
+        while len(moves) < book_plies:
+            if book is not None:
+                m = book.probe(gs, rng = rng)
+            else:
+                legal = gs.valid_moves_packed()
+                m = rng.choice(legal) if legal else None
+            if m is None:
+                break
+            moves.append(to_uci(m))
+            gs.make_packed(m)
+        openings.append((STARTING_FEN, moves))
+    return openings
+
+# the reason a game is over, as (result, termination), or None while it goes on
+def game_over(gs, moves, repetitions):
+
+    if len(moves) == 0:
+        if gs.in_check:
+            return ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+
+    if gs.halfmove_clock >= 100:
+        return "1/2-1/2", "50-move rule"
+
+    if repetitions[gs.zobrist_key] >= 3:
+        return "1/2-1/2", "threefold repetition"
+
+    # kings alone, or with one knight or bishop, can't mate
+    material = [piece[1] for row in gs.board for piece in row if piece != "--" and piece[1] != "K"]
+    if len(material) == 0 or (len(material) == 1 and material[0] in "NB"):
+        return "1/2-1/2", "insufficient material"
+
+    return None
+
+# play one game (players[0] is white), runs in a worker process and returns everything the pgn and summary need
+def play_game(round_number, opening, players, max_plies = MAX_PLIES):
+
+    fen, opening_moves = opening
+    gs = chess_engine.game_state("bitboard", fen = fen)
+
+    # each side keeps its own table and evaluation for the whole game
+    tables = []
+    evaluators = []
+    for player in players:
+        tables.append(transposition.transposition_table(player["hash"]))
+        ai.set_evaluator(player["eval"], player["network"])
+        evaluators.append(ai.evaluator)
+
+    sans = []
+    for uci in opening_moves:
+        moves = gs.valid_moves_packed()
+        m = next(m for m in moves if to_uci(m) == uci)
+        sans.append(book_builder.to_san(gs, m, moves))
+        gs.make_packed(m)
+
+    game = {"round": round_number, "white": players[0]["name"], "black": players[1]["name"], "fen": fen,
+            "book_plies": len(sans), "latencies": [[], []], "nodes": [0, 0], "search_time": [0.0, 0.0]}
+
+    repetitions = Counter([gs.zobrist_key])
+    result = "*"
+    termination = "move limit"
+
+    while len(sans) < max_plies:
+
+        moves = gs.valid_moves_packed()
+        over = game_over(gs, moves, repetitions)
+        if over is not None:
+            result, termination = over
+            break
+
+        side = 0 if gs.white_to_move else 1
+        player = players[side]
+        ai.hash_table = tables[side]
+        ai.evaluator = evaluators[side]
+
+        info = ai.search_info()
+        start = time.perf_counter()
+        best_move, score, pv = ai.search(gs, player["depth"] or ai.MAX_DEPTH, player["time"], player["nodes"], info)
+        elapsed = time.perf_counter() - start
+
+        game["latencies"][side].append(elapsed)
+        game["nodes"][side] += info.nodes
+        game["search_time"][side] += elapsed
+
+        sans.append(book_builder.to_san(gs, best_move.packed, moves))
+        gs.make_packed(best_move.packed)
+        repetitions[gs.zobrist_key] += 1
+
+    game["sans"] = sans
+    game["result"] = result
+    game["termination"] = termination
+    return game
+
+# pgn text for a finished game
+def to_pgn(game, event = "chess_ai self-play"):
+
+    headers = [("Event", event), ("Site", "?"), ("Date", time.strftime("%Y.%m.%d")), ("Round", str(game["round"])),
+               ("White", game["white"]), ("Black", game["black"]), ("Result", game["result"]),
+               ("Termination", game["termination"]), ("PlyCount", str(len(game["sans"])))]
+    if game["fen"] != STARTING_FEN:
+        headers += [("SetUp", "1"), ("FEN", game["fen"])]
+
+    fields = game["fen"].split()
+    white_to_move = fields[1] == "w"
+    number = int(fields[5]) if len(fields) > 5 else 1
+
+    tokens = []
+    for i, san in enumerate(game["sans"]):
+        if white_to_move:
+            tokens.append(str(number) + ".")
+        elif i == 0:
+            tokens.append(str(number) + "...")
+        tokens.append(san)
+        if not white_to_move:
+            number += 1
+        white_to_move = not white_to_move
+    tokens.append(game["result"])
+
+    # movetext wrapped at 80 columns
+    lines = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+
+    return "".join('[{} "{}"]\n'.format(name, value) for name, value in headers) + "\n" + "\n".join(lines) + "\n\n"
+
+# nearest-rank percentile of a sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(len(values) * p / 100) - 1))]
+
+# score, latency and nps lines for each player over all the games (player one is white in the odd rounds)
+# games stopped at the move limit ("*") are counted apart and left out of the score
+def summary(games, players):
+
+    lines = []
+    for i, player in enumerate(players):
+        wins = draws = losses = unfinished = 0
+        latencies = []
+        nodes = 0
+        search_time = 0.0
+        for game in games:
+            side = 0 if (game["round"] % 2 == 1) == (i == 0) else 1
+            latencies += game["latencies"][side]
+            nodes += game["nodes"][side]
+            search_time += game["search_time"][side]
+            if game["result"] == "*":
+                unfinished += 1
+            elif game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == (side == 0):
+                wins += 1
+            else:
+                losses += 1
+
+        latencies.sort()
+        lines.append("{}: +{} ={} -{}  score {:.1f}/{}{}".format(player["name"], wins, draws, losses, wins + draws / 2,
+                                                                 wins + draws + losses,
+                                                                 "  ({} unfinished)".format(unfinished) if unfinished else ""))
+        lines.append("  {} moves  p50 {:.1f} ms  p95 {:.1f} ms  p99 {:.1f} ms  {:.0f} nps".format(
+            len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000, nodes / search_time if search_time > 0 else 0))
+
+    terminations = Counter(game["termination"] for game in games)
+    lines.append("endings: " + ", ".join("{} {}".format(count, name) for name, count in terminations.most_common()))
+    return "\n".join(lines)
+
+# play the match, appending games to output as they finish, returns the finished games in round order
+def run(one, two, output, games = GAMES, epd_path = None, book_plies = BOOK_PLIES, workers = None,
+        max_plies = MAX_PLIES, seed = None, progress = sys.stderr):
+
+    openings = read_openings((games + 1) // 2, epd_path, book_plies, seed)
+    if not openings:
+        raise ValueError("no openings to play")
+
+    # odd rounds have player one as white, the next round replays the same opening with the colours swapped
+    jobs = []
+    for round_number in range(1, games + 1):
+        opening = openings[((round_number - 1) // 2) % len(openings)]
+        players = (one, two) if round_number % 2 == 1 else (two, one)
+        jobs.append((round_number, opening, players))
+
+    finished = []
+    start = time.time()
+    with open(output, "a", encoding = "utf-8") as pgn, ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(play_game, round_number, opening, players, max_plies)
+                   for round_number, opening, players in jobs]
+        for future in as_completed(futures):
+            game = future.result()
+            pgn.write(to_pgn(game))
+            pgn.flush()
+            finished.append(game)
+
+            if progress is not None:
+                progress.write("\r{}/{} games  {:.0f}s   ".format(len(finished), games, time.time() - start))
+                progress.flush()
+
+    if progress is not None:
+        progress.write("\n")
+
+    finished.sort(key = lambda game: game["round"])
+    return finished
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "play ai self-play games without the gui")
+    parser.add_argument("--one", default = "", help = "first player's settings, e.g. depth=4,eval=pst")
+    parser.add_argument("--two", default = "", help = "second player's settings, e.g. time=0.2")
+    parser.add_argument("-o", "--output", required = True, help = "pgn file the games are appended to")
+    parser.add_argument("--games", type = int, default = GAMES, help = "number of games")
+    parser.add_argument("--epd", help = "take openings from this epd file instead of the book")
+    parser.add_argument("--book-plies", type = int, default = BOOK_PLIES, help = "random book plies per opening")
+    parser.add_argument("--max-plies", type = int, default = MAX_PLIES, help = "stop a game unfinished after this")
+    parser.add_argument("--workers", type = int, help = "worker processes (default: all cores)")
+    parser.add_argument("--seed", type = int, help = "seed for the book openings")
+    parser.add_argument("--quiet", action = "store_true", help = "no progress line")
+    args = parser.parse_args(argv)
+
+    try:
+        one = parse_player(args.one)
+        two = parse_player(args.two)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+
+    games = run(one, two, args.output, args.games, args.epd, args.book_plies, args.workers, args.max_plies,
+                args.seed, None if args.quiet else sys.stderr)
+    print(summary(games, (one, two)))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+# packed 16 bit move format shared by the generators, make/undo, the search and the transposition table
+# bits 0-5 start square, 6-11 end square (row * 8 + col), 12-13 flag, 14-15 promotion piece
+
+# flags
+NORMAL = 0
+PROMOTION = 1
+ENPASSANT = 2
+CASTLE = 3
+
+# promotion piece index (only meaningful with the promotion flag)
+PROMOTION_PIECES = ("N", "B", "R", "Q")
+PROMOTION_INDEX = {piece: i for i, piece in enumerate(PROMOTION_PIECES)}
+
+# bits that identify a move for matching clicks and book moves (everything but the flag)
+MATCH_MASK = 0xCFFF
+
+def pack(start, end, flag = NORMAL, promotion = 0):
+    return start | (end << 6) | (flag << 12) | (promotion << 14)
+
+def start_square(m):
+    return m & 63
+
+def end_square(m):
+    return (m >> 6) & 63
+
+def flag(m):
+    return (m >> 12) & 3
+
+def promotion_piece(m):
+    return PROMOTION_PIECES[m >> 14]
+
+# long algebraic (uci) string, e.g. e2e4 or e7e8q
+def to_uci(m):
+    start = start_square(m)
+    end = end_square(m)
+    uci = "abcdefgh"[start & 7] + str(8 - (start >> 3)) + "abcdefgh"[end & 7] + str(8 - (end >> 3))
+    if flag(m) == PROMOTION:
+        uci += promotion_piece(m).lower()
+    return uci
@@ -0,0 +1,89 @@
+# move ordering for the ai search: hash move first, then captures by mvv-lva, killer moves, and quiet moves by history
+# moves are packed ints (see move_encoding) handed out one at a time so a cutoff early in the list skips scoring the rest
+
+from move_encoding import PROMOTION, ENPASSANT, start_square, end_square, flag, promotion_piece
+
+MAX_PLY = 128
+
+# a move that captures nothing and doesn't promote, read off the board it's about to be played on
+def is_quiet(board, m):
+    move_flag = flag(m)
+    end = end_square(m)
+    return move_flag != PROMOTION and move_flag != ENPASSANT and board[end >> 3][end & 7] == "--"
+
+# hand out the highest scored move left, swapping the last move into its place (no full sort)
+def pick_best(moves, scores):
+    while moves:
+        best = 0
+        for i in range(1, len(scores)):
+            if scores[i] > scores[best]:
+                best = i
+        picked = moves[best]
+        moves[best] = moves[-1]
+        scores[best] = scores[-1]
+        moves.pop()
+        scores.pop()
+        yield picked
+
+class move_ordering():
+
+    # constructor (piece_scores is the piece value table used for mvv-lva)
+    def __init__(self, piece_scores):
+        self.piece_scores = piece_scores
+        self.killers = [[0, 0] for i in range(MAX_PLY)]
+        self.history = [0] * 4096 # indexed by the start and end square bits of a move
+
+    # most valuable victim first, least valuable attacker breaks ties (promotions count as winning the new piece)
+    def mvv_lva(self, board, m):
+        move_flag = flag(m)
+        if move_flag == ENPASSANT:
+            victim = self.piece_scores["P"]
+        else:
+            end = end_square(m)
+            captured = board[end >> 3][end & 7]
+            victim = self.piece_scores[captured[1]] if captured != "--" else 0
+            if move_flag == PROMOTION:
+                victim += self.piece_scores[promotion_piece(m)]
+        start = start_square(m)
+        return victim * 10 - self.piece_scores[board[start >> 3][start & 7][1]]
+
+    # yield moves in search order: hash move, captures, killers, then the remaining quiet moves
+    def pick(self, board, moves, tt_move = 0, ply = 0):
+
+        if tt_move and tt_move in moves:
+            yield tt_move
+        else:
+            tt_move = 0
+
+        captures = []
+        quiets = []
+        for m in moves:
+            if m == tt_move:
+                continue
+            if is_quiet(board, m):
+                quiets.append(m)
+            else:
+                captures.append(m)
+
+        yield from pick_best(captures, [self.mvv_lva(board, m) for m in captures])
+
+        # killers are only tried if they're legal quiet moves here
+        killers = self.killers[ply] if ply < MAX_PLY else (0, 0)
+        for killer in killers:
+            if killer and killer in quiets:
+                quiets.remove(killer)
+                yield killer
+
+        history = self.history
+        yield from pick_best(quiets, [history[m & 0xFFF] for m in quiets])
+
+    # record a quiet move that caused a beta cutoff
+    def cutoff(self, board, m, depth, ply):
+        if not is_quiet(board, m):
+            return
+
+        if ply < MAX_PLY and self.killers[ply][0] != m:
+            self.killers[ply][1] = self.killers[ply][0]
+            self.killers[ply][0] = m
+
+        self.history[m & 0xFFF] += depth * depth
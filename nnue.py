@@ -0,0 +1,171 @@
+# nnue-style evaluation for the ai, reading stockfish nnue networks (halfkp 256x2-32-32, the nn.bin files used by
+# the sf-nnue builds in opening_book/Stockfish-NNUE, which the exes themselves can't be run to use on linux)
+#
+# the first layer is a 41024 -> 256 int16 feature transformer per side (features are (king square, piece, square)
+# for every non-king piece), its output is kept in an accumulator on the game_state and updated in set_square,
+# so each make/undo only adds or subtracts the columns of the few features that changed
+# the small layers after it (int8 weights in the file, widened to int32 when loaded so the numpy products can't
+# overflow) are run at each evaluation
+
+import os
+import struct
+import numpy as np
+import evaluation
+
+# default network file (next to this file, so it's found from any working directory)
+NETWORK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book", "Stockfish-NNUE", "nn.bin")
+
+VERSION = 0x7AF32F16
+HALF_DIMENSIONS = 256
+INPUT_DIMENSIONS = 41024 # 64 king squares * 641 piece-square features
+HIDDEN = 32
+WEIGHT_SCALE_BITS = 6
+FV_SCALE = 16
+PAWN_VALUE = 208 # stockfish's endgame pawn, output is scaled to centipawns with it
+
+# piece-square feature offsets (own pieces first), as stockfish numbers them
+PS_END = 10 * 64 + 1
+OWN_OFFSETS = {"P": 1, "N": 2 * 64 + 1, "B": 4 * 64 + 1, "R": 6 * 64 + 1, "Q": 8 * 64 + 1}
+ENEMY_OFFSETS = {"P": 1 * 64 + 1, "N": 3 * 64 + 1, "B": 5 * 64 + 1, "R": 7 * 64 + 1, "Q": 9 * 64 + 1}
+
+WHITE = 0
+BLACK = 1
+
+class nnue_network():
+
+    # constructor (reads a network file, raises ValueError if it isn't a halfkp 256x2-32-32 network)
+    def __init__(self, path):
+
+        with open(path, "rb") as net:
+            data = net.read()
+
+        if len(data) < 12:
+            raise ValueError("not an nnue network: " + path)
+        version, architecture_hash, description_size = struct.unpack_from("<III", data, 0)
+        if version != VERSION:
+            raise ValueError("unsupported nnue version " + hex(version) + ": " + path)
+
+        offset = 12
+        self.description = data[offset:offset + description_size].decode("utf-8", "replace")
+        offset += description_size
+
+        sizes = (4 + HALF_DIMENSIONS * 2 + INPUT_DIMENSIONS * HALF_DIMENSIONS * 2 +
+                 4 + HIDDEN * 4 + HIDDEN * 2 * HALF_DIMENSIONS + HIDDEN * 4 + HIDDEN * HIDDEN + 4 + HIDDEN)
+        if len(data) - offset != sizes:
+            raise ValueError("unsupported nnue architecture (expected halfkp 256x2-32-32): " + path)
+
+        def read(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(data, dtype = dtype, count = count, offset = offset)
+            offset += array.nbytes
+            return array
+
+        # feature transformer
+        offset += 4 # layer hash
+        self.feature_biases = read("<i2", HALF_DIMENSIONS).astype(np.int16)
+        self.feature_weights = read("<i2", INPUT_DIMENSIONS * HALF_DIMENSIONS).astype(np.int16).reshape(
+            INPUT_DIMENSIONS, HALF_DIMENSIONS)
+
+        # hidden and output layers
+        offset += 4 # network hash
+        self.biases1 = read("<i4", HIDDEN).astype(np.int32)
+        self.weights1 = read("i1", HIDDEN * 2 * HALF_DIMENSIONS).astype(np.int32).reshape(HIDDEN, 2 * HALF_DIMENSIONS)
+        self.biases2 = read("<i4", HIDDEN).astype(np.int32)
+        self.weights2 = read("i1", HIDDEN * HIDDEN).astype(np.int32).reshape(HIDDEN, HIDDEN)
+        self.output_bias = int(read("<i4", 1)[0])
+        self.output_weights = read("i1", HIDDEN).astype(np.int32)
+
+    # score in centipawns for the side to move, from its accumulator and the other side's
+    def propagate(self, us, them):
+        x = np.clip(np.concatenate((us, them)), 0, 127).astype(np.int32)
+        x = np.clip((self.biases1 + self.weights1 @ x) >> WEIGHT_SCALE_BITS, 0, 127)
+        x = np.clip((self.biases2 + self.weights2 @ x) >> WEIGHT_SCALE_BITS, 0, 127)
+        value = int((self.output_bias + int(self.output_weights @ x)) / FV_SCALE)
+        return int(value * 100 / PAWN_VALUE)
+
+    # evaluation with this network from the side to move's point of view, the accumulator is attached to gs the
+    # first time it's seen, and rebuilt if it belongs to another network (two networks can take turns on one game)
+    # (with evaluation.DEBUG set the accumulator is checked against one built from scratch)
+    def evaluate(self, gs):
+        if gs.nnue is None or gs.nnue.network is not self:
+            gs.nnue = accumulator(self, gs)
+        if evaluation.DEBUG:
+            check(gs)
+        return gs.nnue.evaluate(gs)
+
+# feature index of a piece on our square sq (a8 = 0) seen from perspective, with that side's king on king_sq
+# (stockfish squares count from a1, and black's view is the board turned around)
+def feature(perspective, king_sq, piece, sq):
+    if perspective == WHITE:
+        king_sq ^= 56
+        sq ^= 56
+        offsets = OWN_OFFSETS if piece[0] == "w" else ENEMY_OFFSETS
+    else:
+        king_sq ^= 7
+        sq ^= 7
+        offsets = OWN_OFFSETS if piece[0] == "b" else ENEMY_OFFSETS
+    return sq + offsets[piece[1]] + PS_END * king_sq
+
+# first layer output for both sides, kept on game_state.nnue and updated by set_square
+class accumulator():
+
+    # constructor (built from the board, then kept in step with it)
+    def __init__(self, net, gs):
+        self.network = net
+        self.values = [None, None]
+        self.king_squares = [0, 0]
+        self.dirty = [True, True]
+        self.refresh(gs.board)
+
+    # rebuild a side from scratch (after its king has moved, every one of its features changes)
+    def refresh(self, board, perspective = None):
+        for side in (WHITE, BLACK) if perspective is None else (perspective,):
+            king = "wK" if side == WHITE else "bK"
+            features = []
+            king_sq = None
+            for sq in range(64):
+                if board[sq >> 3][sq & 7] == king:
+                    king_sq = sq
+            for sq in range(64):
+                piece = board[sq >> 3][sq & 7]
+                if piece != "--" and piece[1] != "K":
+                    features.append(feature(side, king_sq, piece, sq))
+
+            net = self.network
+            self.values[side] = net.feature_biases + net.feature_weights[features].sum(axis = 0, dtype = np.int16)
+            self.king_squares[side] = king_sq
+            self.dirty[side] = False
+
+    # a square changed from old_piece to new_piece
+    def update(self, sq, old_piece, new_piece):
+
+        # kings aren't features, but a king move changes every feature of its own side, it's rebuilt when next evaluated
+        if old_piece[1] == "K":
+            self.dirty[WHITE if old_piece[0] == "w" else BLACK] = True
+        if new_piece[1] == "K":
+            self.dirty[WHITE if new_piece[0] == "w" else BLACK] = True
+
+        weights = self.network.feature_weights
+        for side in (WHITE, BLACK):
+            if self.dirty[side]:
+                continue
+            king_sq = self.king_squares[side]
+            if old_piece != "--" and old_piece[1] != "K":
+                self.values[side] -= weights[feature(side, king_sq, old_piece, sq)]
+            if new_piece != "--" and new_piece[1] != "K":
+                self.values[side] += weights[feature(side, king_sq, new_piece, sq)]
+
+    def evaluate(self, gs):
+        if self.dirty[WHITE] or self.dirty[BLACK]:
+            self.refresh(gs.board, None if self.dirty[WHITE] and self.dirty[BLACK] else
+                         (WHITE if self.dirty[WHITE] else BLACK))
+        if gs.white_to_move:
+            return self.network.propagate(self.values[WHITE], self.values[BLACK])
+        return self.network.propagate(self.values[BLACK], self.values[WHITE])
+
+# debug cross-check, raises AssertionError if the incremental accumulator has drifted from the board
+def check(gs):
+    fresh = accumulator(gs.nnue.network, gs)
+    for side in (WHITE, BLACK):
+        if not gs.nnue.dirty[side] and not np.array_equal(gs.nnue.values[side], fresh.values[side]):
+            raise AssertionError("nnue accumulator does not match the board")
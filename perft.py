@@ -0,0 +1,145 @@
+# perft: count the leaf nodes of the legal move tree to check and time game_state's move generation
+# results are compared against the published counts and against python-chess's legal move generator
+#
+# usage: python perft.py [--position NAME | --fen FEN] [--depth N] [--backend list|bitboard] [--divide] [--no-reference]
+
+import argparse
+import sys
+import time
+import chess
+import chess_engine
+from move_encoding import to_uci
+
+# standard perft positions with their published node counts (index is depth - 1), and a default depth
+# that runs in seconds on the list backend
+POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+              (20, 400, 8902, 197281, 4865609), 3),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 (48, 2039, 97862, 4085603), 2),
+    "enpassant": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  (14, 191, 2812, 43238, 674624), 4),
+    "castling": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                 (6, 264, 9467, 422333), 3),
+    "promotion": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  (44, 1486, 62379, 2103487), 2),
+}
+
+# number of leaf nodes depth plies below this position
+def perft(gs, depth):
+
+    moves = gs.valid_moves_packed()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for m in moves:
+        gs.make_packed(m)
+        nodes += perft(gs, depth - 1)
+        gs.undo_packed()
+
+    return nodes
+
+# perft split by root move, as {uci move: nodes}
+def divide(gs, depth):
+
+    counts = {}
+    for m in gs.valid_moves_packed():
+        gs.make_packed(m)
+        counts[to_uci(m)] = perft(gs, depth - 1)
+        gs.undo_packed()
+
+    return counts
+
+# the same counts from python-chess, used as the reference
+def reference_perft(board, depth):
+
+    if depth <= 1:
+        return board.legal_moves.count() if depth == 1 else 1
+
+    nodes = 0
+    for m in board.legal_moves:
+        board.push(m)
+        nodes += reference_perft(board, depth - 1)
+        board.pop()
+
+    return nodes
+
+def reference_divide(board, depth):
+
+    counts = {}
+    for m in board.legal_moves:
+        board.push(m)
+        counts[m.uci()] = reference_perft(board, depth - 1)
+        board.pop()
+
+    return counts
+
+# run one position, print the result line (and divide if asked), returns True if every check passed
+def run(name, fen, depth, expected = None, backend = "list", show_divide = False, reference = True):
+
+    board = chess.Board(fen)
+    gs = chess_engine.game_state(backend, fen = fen)
+
+    start = time.time()
+    counts = divide(gs, depth)
+    elapsed = time.time() - start
+    nodes = sum(counts.values())
+    nps = nodes / elapsed if elapsed > 0 else 0
+
+    ok = True
+    line = "{:<10} depth {} {:>10} nodes {:>8.2f}s {:>9.0f} nps".format(name, depth, nodes, elapsed, nps)
+
+    if expected is not None:
+        line += "  expected " + ("ok" if nodes == expected else "MISMATCH " + str(expected))
+        ok = ok and nodes == expected
+
+    reference_counts = None
+    if reference:
+        reference_counts = reference_divide(board, depth)
+        reference_nodes = sum(reference_counts.values())
+        line += "  python-chess " + ("ok" if nodes == reference_nodes else "MISMATCH " + str(reference_nodes))
+        ok = ok and nodes == reference_nodes
+
+    print(line)
+
+    # print every root move, or just the ones that disagree with the reference when something is wrong
+    if show_divide or (reference_counts is not None and not ok):
+        for uci in sorted(set(counts) | set(reference_counts or {})):
+            mine = counts.get(uci, "missing")
+            if reference_counts is None:
+                print("  " + uci + ": " + str(mine))
+            elif show_divide or mine != reference_counts.get(uci, "missing"):
+                print("  " + uci + ": " + str(mine) + " (python-chess " + str(reference_counts.get(uci, "missing")) + ")")
+
+    return ok
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "perft node counts for game_state move generation")
+    parser.add_argument("--position", choices = sorted(POSITIONS), help = "standard position to run (default: all)")
+    parser.add_argument("--fen", help = "run a custom position instead")
+    parser.add_argument("--depth", type = int, help = "search depth (default: per position)")
+    parser.add_argument("--backend", default = "list", choices = ("list", "bitboard"))
+    parser.add_argument("--divide", action = "store_true", help = "print node counts per root move")
+    parser.add_argument("--no-reference", action = "store_true", help = "skip the python-chess comparison")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("fen", args.fen, args.depth or 3, None)]
+    else:
+        names = [args.position] if args.position else list(POSITIONS)
+        jobs = []
+        for name in names:
+            fen, counts, default_depth = POSITIONS[name]
+            depth = args.depth or default_depth
+            jobs.append((name, fen, depth, counts[depth - 1] if depth <= len(counts) else None))
+
+    ok = True
+    for name, fen, depth, expected in jobs:
+        ok = run(name, fen, depth, expected, args.backend, args.divide, not args.no_reference) and ok
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# polyglot opening book reader, the file is memory mapped once and probed by binary search on the zobrist key
+# each entry is 16 big-endian bytes: key (64 bits), move (16), weight (16), learn (32), sorted by key
+
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+from move_encoding import PROMOTION, CASTLE, PROMOTION_INDEX, pack, start_square, end_square, flag, promotion_piece
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+ENTRY_BYTES = 16
+
+# book folder, found next to this file so the books load from any working directory
+BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book", "poly17", "books")
+
+# default book used by the ai
+BOOK_PATH = os.path.join(BOOK_DIR, "Perfect2017.bin")
+
+# default books merged by merged_book, as (path, weight) where weight scales each book's entry weights,
+# and the file the merged index is kept in
+BOOKS = ((os.path.join(BOOK_DIR, "Perfect2017.bin"), 1.0),
+         (os.path.join(BOOK_DIR, "Perfect2017-SF12.bin"), 1.0),
+         (os.path.join(BOOK_DIR, "Perfect2017-LC0.bin"), 1.0))
+INDEX_PATH = os.path.join(BOOK_DIR, "merged.idx")
+
+INDEX_MAGIC = b"PGIX"
+INDEX_VERSION = 1
+
+# books and merged indexes opened so far, so each file is only opened and mapped (or loaded) once
+open_books = {}
+open_merged_books = {}
+
+# convert a polyglot move to a packed move (see move_encoding) on the given list board
+# polyglot squares are file + 8 * rank with a1 = 0, castling is written as the king taking its own rook
+def from_polyglot(raw, board):
+
+    start = (7 - ((raw >> 9) & 7)) * 8 + ((raw >> 6) & 7)
+    end = (7 - ((raw >> 3) & 7)) * 8 + (raw & 7)
+    promotion = (raw >> 12) & 7
+
+    if promotion:
+        # polyglot counts promotions from 1 (knight), the packed move from 0
+        return pack(start, end, PROMOTION, promotion - 1)
+
+    piece = board[start >> 3][start & 7]
+    if piece[1] == "K" and board[end >> 3][end & 7] == piece[0] + "R":
+        end = start + 2 if end > start else start - 2
+        return pack(start, end, CASTLE)
+
+    return pack(start, end)
+
+# convert a packed move to a polyglot move (castling becomes the king taking its own rook)
+def to_polyglot(m):
+
+    start = start_square(m)
+    end = end_square(m)
+    move_flag = flag(m)
+
+    if move_flag == CASTLE:
+        end = (start & 56) | (7 if end > start else 0)
+
+    raw = (end & 7) | ((7 - (end >> 3)) << 3) | ((start & 7) << 6) | ((7 - (start >> 3)) << 9)
+    if move_flag == PROMOTION:
+        raw |= (PROMOTION_INDEX[promotion_piece(m)] + 1) << 12
+    return raw
+
+# the legal packed move in gs matching a polyglot move, or None (the one move is checked, no move list is built)
+def legal_move(gs, raw):
+    return gs.legal_packed(from_polyglot(raw, gs.board))
+
+# write (key, polyglot move, weight) entries as a polyglot book, weights are scaled down per position to fit 16 bits
+# (entries must come sorted by key, only one position's moves are held at a time so any number can be streamed)
+def write_polyglot(path, entries):
+
+    with open(path, "wb") as book:
+        for key, group in groupby(entries, lambda entry: entry[0]):
+            moves = [(raw, weight) for entry_key, raw, weight in group]
+            heaviest = max(weight for raw, weight in moves)
+            scale = 65535 / heaviest if heaviest > 65535 else 1
+            moves.sort(key = lambda entry: -entry[1])
+            for raw, weight in moves:
+                book.write(ENTRY.pack(key, raw, max(int(weight * scale), 1 if weight else 0), 0))
+
+class polyglot_book():
+
+    # constructor (maps the whole file read only, an empty or missing file raises OSError/ValueError)
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.size = len(self.data) // ENTRY_BYTES
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    # index of the first entry for key (or where it would be)
+    def first_entry(self, key):
+        data = self.data
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(data, middle * ENTRY_BYTES)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # every (key, polyglot move, weight) in file order
+    def all_entries(self):
+        data = self.data
+        for i in range(self.size):
+            key, raw, weight, learn = ENTRY.unpack_from(data, i * ENTRY_BYTES)
+            yield key, raw, weight
+
+    # all (polyglot move, weight) pairs stored for key
+    def entries(self, key):
+        data = self.data
+        found = []
+        i = self.first_entry(key)
+        while i < self.size:
+            entry_key, raw, weight, learn = ENTRY.unpack_from(data, i * ENTRY_BYTES)
+            if entry_key != key:
+                break
+            found.append((raw, weight))
+            i += 1
+        return found
+
+    # pick a polyglot move for key, at random by weight or the heaviest, returns 0 if the position isn't in the book
+    def choose(self, key, best = False, rng = random):
+
+        data = self.data
+        start = self.first_entry(key)
+
+        # one pass for the total (or best) weight, a second to find the random pick, no lists built
+        total = 0
+        heaviest = 0
+        heaviest_move = 0
+        i = start
+        while i < self.size:
+            entry_key, raw, weight, learn = ENTRY.unpack_from(data, i * ENTRY_BYTES)
+            if entry_key != key:
+                break
+            total += weight
+            if weight > heaviest or not heaviest_move:
+                heaviest = weight
+                heaviest_move = raw
+            i += 1
+
+        if best or total == 0:
+            return heaviest_move
+
+        pick = rng.randrange(total)
+        i = start
+        while True:
+            entry_key, raw, weight, learn = ENTRY.unpack_from(data, i * ENTRY_BYTES)
+            if pick < weight:
+                return raw
+            pick -= weight
+            i += 1
+
+    # book move for the position in gs as a packed move, or None (always one of the legal moves)
+    def probe(self, gs, best = False, rng = random):
+        raw = self.choose(gs.zobrist_key, best, rng)
+        return legal_move(gs, raw) if raw else None
+
+# several polyglot books merged into one sorted index: keys, the offset of each key's moves, and the moves and weights
+# (a move's weight is the sum over the books of book weight * entry weight)
+# the index is saved next to the books and reloaded as long as the books and weights haven't changed
+class merged_book():
+
+    # constructor (index_path None keeps the index in memory only)
+    def __init__(self, books = BOOKS, index_path = INDEX_PATH):
+
+        self.books = [(path, float(weight)) for path, weight in books]
+        self.index_path = index_path
+
+        # what the saved index must have been built from to be reused
+        self.sources = [[path, weight, os.path.getsize(path), os.path.getmtime(path)] for path, weight in self.books]
+
+        if index_path is None or not self.load(index_path):
+            self.build()
+            if index_path is not None:
+                self.save(index_path)
+
+    def build(self):
+
+        merged = {}
+        for path, book_weight in self.books:
+            with polyglot_book(path) as book:
+                for key, raw, weight in book.all_entries():
+                    moves = merged.setdefault(key, {})
+                    moves[raw] = moves.get(raw, 0) + weight * book_weight
+
+        self.keys = array("Q")
+        self.offsets = array("I", [0])
+        self.moves = array("H")
+        self.weights = array("I")
+
+        for key in sorted(merged):
+            self.keys.append(key)
+            for raw, weight in sorted(merged[key].items(), key = lambda entry: -entry[1]):
+                self.moves.append(raw)
+                self.weights.append(min(int(round(weight)), 0xFFFFFFFF))
+            self.offsets.append(len(self.moves))
+
+    # reload a saved index, returns False if it's missing or stale
+    def load(self, path):
+
+        try:
+            with open(path, "rb") as index:
+                if index.read(4) != INDEX_MAGIC:
+                    return False
+                version, header_size, key_count, move_count = struct.unpack("<IIII", index.read(16))
+                header = json.loads(index.read(header_size).decode("utf-8"))
+                if version != INDEX_VERSION or header["sources"] != self.sources or header["byteorder"] != sys.byteorder:
+                    return False
+
+                self.keys = array("Q")
+                self.offsets = array("I")
+                self.moves = array("H")
+                self.weights = array("I")
+                self.keys.fromfile(index, key_count)
+                self.offsets.fromfile(index, key_count + 1)
+                self.moves.fromfile(index, move_count)
+                self.weights.fromfile(index, move_count)
+        except (OSError, EOFError, ValueError, KeyError, struct.error):
+            return False
+
+        return True
+
+    # save the index (written to a temporary file first so a reader never sees half of it)
+    def save(self, path):
+
+        header = json.dumps({"sources": self.sources, "byteorder": sys.byteorder}).encode("utf-8")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as index:
+            index.write(INDEX_MAGIC)
+            index.write(struct.pack("<IIII", INDEX_VERSION, len(header), len(self.keys), len(self.moves)))
+            index.write(header)
+            self.keys.tofile(index)
+            self.offsets.tofile(index)
+            self.moves.tofile(index)
+            self.weights.tofile(index)
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # range of key's moves in self.moves (empty if it isn't in the book)
+    def find(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.offsets[i], self.offsets[i + 1]
+        return 0, 0
+
+    # all (polyglot move, weight) pairs for key, heaviest first
+    def entries(self, key):
+        start, end = self.find(key)
+        return [(self.moves[i], self.weights[i]) for i in range(start, end)]
+
+    # pick a polyglot move for key, at random by weight or the heaviest, returns 0 if the position isn't in the book
+    def choose(self, key, best = False, rng = random):
+
+        start, end = self.find(key)
+        if start == end:
+            return 0
+
+        # moves are stored heaviest first
+        total = sum(self.weights[start:end])
+        if best or total == 0:
+            return self.moves[start]
+
+        pick = rng.randrange(total)
+        for i in range(start, end):
+            if pick < self.weights[i]:
+                return self.moves[i]
+            pick -= self.weights[i]
+
+    # book move for the position in gs as a packed move, or None (always one of the legal moves)
+    def probe(self, gs, best = False, rng = random):
+        raw = self.choose(gs.zobrist_key, best, rng)
+        return legal_move(gs, raw) if raw else None
+
+    # write the merged book out as a regular polyglot book
+    def write_polyglot(self, path):
+        write_polyglot(path, ((self.keys[k], self.moves[i], self.weights[i])
+                              for k in range(len(self.keys)) for i in range(self.offsets[k], self.offsets[k + 1])))
+
+# open a book, reusing the mapping if it's already open
+def open_book(path = BOOK_PATH):
+    if path not in open_books:
+        open_books[path] = polyglot_book(path)
+    return open_books[path]
+
+# open a merged book, reusing it if it's already loaded (raises OSError/ValueError if it can't be, and the failure
+# is kept, so a missing or broken book is only tried once rather than on every probe)
+def open_merged(books = BOOKS, index_path = INDEX_PATH):
+    key = (tuple((path, float(weight)) for path, weight in books), index_path)
+    if key not in open_merged_books:
+        try:
+            open_merged_books[key] = merged_book(books, index_path)
+        except (OSError, ValueError) as error:
+            open_merged_books[key] = error
+    book = open_merged_books[key]
+    if isinstance(book, Exception):
+        raise book
+    return book
+
+# merge books from the command line, e.g. python polyglot_book.py -o merged.bin a.bin b.bin:2
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "merge polyglot books")
+    parser.add_argument("books", nargs = "+", help = "book path, optionally followed by :weight (default 1)")
+    parser.add_argument("-o", "--output", required = True, help = "merged polyglot book to write")
+    parser.add_argument("--index", help = "also keep the merged index here")
+    args = parser.parse_args(argv)
+
+    books = []
+    for book in args.books:
+        path, colon, weight = book.rpartition(":")
+        books.append((path, float(weight)) if colon else (book, 1.0))
+
+    merged = merged_book(books, args.index)
+    merged.write_polyglot(args.output)
+    print("merged " + str(len(books)) + " books, " + str(len(merged)) + " positions, " + str(len(merged.moves)) + " moves")
+
+if __name__ == "__main__":
+    main()
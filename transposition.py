@@ -0,0 +1,156 @@
+# transposition table for the ai search, kept in two flat arrays so its memory is fixed when it's built
+# each slot is a 64 bit zobrist key plus a 64 bit packed entry (16 bytes per slot)
+# the key is stored xor'ed with the entry, so when several processes share the table (see ai.parallel_search)
+# a slot torn by two writers at once just reads back as a miss
+
+from array import array
+
+# bound types
+EXACT = 0
+LOWER = 1 # search failed high, real score is at least this
+UPPER = 2 # search failed low, real score is at most this
+
+SLOT_BYTES = 16
+SCORE_OFFSET = 1 << 31
+
+# packed entry layout: move (16 bits) | score + offset (32 bits) | depth (8 bits) | bound (2 bits) | used (1 bit) | age (5 bits)
+MOVE_MASK = 0xFFFF
+SCORE_SHIFT = 16
+DEPTH_SHIFT = 48
+BOUND_SHIFT = 56
+USED = 1 << 58
+AGE_SHIFT = 59
+
+# number of slots for a table of size_mb (rounded down to a power of two so indexing is a mask)
+def slot_count(size_mb):
+    slots = 2
+    while slots * 2 * SLOT_BYTES <= size_mb * 1024 * 1024:
+        slots *= 2
+    return slots
+
+# bytes of shared memory a table of size_mb needs
+def table_bytes(size_mb):
+    return slot_count(size_mb) * SLOT_BYTES
+
+class transposition_table():
+
+    # constructor (replacement is "depth" for one depth-preferred slot per index,
+    # or "two_tier" for buckets of a depth-preferred slot plus an always-replace slot,
+    # shared is a writable buffer of table_bytes(size_mb) to keep the table in, e.g. a SharedMemory's buf)
+    def __init__(self, size_mb = 16, replacement = "depth", shared = None):
+
+        if replacement not in ("depth", "two_tier"):
+            raise ValueError("unknown replacement scheme: " + str(replacement))
+
+        self.replacement = replacement
+
+        slots = slot_count(size_mb)
+        self.size = slots
+
+        if replacement == "two_tier":
+            self.mask = (slots // 2 - 1) << 1 # bucket start is always even
+        else:
+            self.mask = slots - 1
+
+        if shared is None:
+            self.keys = array("Q", bytes(8 * slots))
+            self.data = array("Q", bytes(8 * slots))
+        else:
+            view = memoryview(shared)
+            self.keys = view[:8 * slots].cast("B").cast("Q")
+            self.data = view[8 * slots:16 * slots].cast("B").cast("Q")
+        self.age = 0
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0 # misses where the slot held a different position
+        self.stores = 0
+        self.overwrites = 0 # stores that evicted a different position
+
+    def stats(self):
+        return {"probes": self.probes, "hits": self.hits, "misses": self.misses, "collisions": self.collisions,
+                "stores": self.stores, "overwrites": self.overwrites, "slots": self.size, "replacement": self.replacement}
+
+    # start a new search, entries from older searches become preferred for replacement
+    def new_search(self):
+        self.age = (self.age + 1) & 31
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = 0
+            self.data[i] = 0
+        self.age = 0
+
+    # does slot i hold key
+    def holds(self, i, key):
+        data = self.data[i]
+        return data & USED and self.keys[i] ^ data == key
+
+    # look up a position, returns (move, score, depth, bound) or None
+    def probe(self, key):
+
+        self.probes += 1
+        i = key & self.mask
+
+        if not self.holds(i, key) and self.replacement == "two_tier" and self.holds(i + 1, key):
+            i += 1
+
+        # read once, another process may be writing the slot
+        data = self.data[i]
+        if data & USED and self.keys[i] ^ data == key:
+            self.hits += 1
+            return (data & MOVE_MASK, ((data >> SCORE_SHIFT) & 0xFFFFFFFF) - SCORE_OFFSET,
+                    (data >> DEPTH_SHIFT) & 0xFF, (data >> BOUND_SHIFT) & 3)
+
+        self.misses += 1
+        if data & USED:
+            self.collisions += 1
+        return None
+
+    # store a search result, move is a 16 bit move (0 for none)
+    def store(self, key, move, score, depth, bound):
+
+        self.stores += 1
+        data = (move & MOVE_MASK) | ((score + SCORE_OFFSET) << SCORE_SHIFT) | (min(depth, 255) << DEPTH_SHIFT) | \
+            (bound << BOUND_SHIFT) | USED | (self.age << AGE_SHIFT)
+
+        i = key & self.mask
+        old = self.data[i]
+
+        # keep the old best move if this result didn't find one (a copy in the always-replace slot is dropped,
+        # since the position is about to be stored again)
+        same = self.holds(i, key)
+
+        if self.replacement == "two_tier" and self.holds(i + 1, key):
+            if not move:
+                data |= self.data[i + 1] & MOVE_MASK
+            self.data[i + 1] = 0
+        elif not move and same:
+            data |= old & MOVE_MASK
+
+        # depth preferred slot takes the entry if it's empty, the same position, stale, or not deeper
+        if not old & USED or same or (old >> AGE_SHIFT) != self.age or ((old >> DEPTH_SHIFT) & 0xFF) <= depth:
+
+            if old & USED and not same:
+                if self.replacement == "two_tier":
+                    # demote the old entry to the always-replace slot
+                    if self.data[i + 1] & USED:
+                        self.overwrites += 1
+                    self.keys[i + 1] = self.keys[i]
+                    self.data[i + 1] = old
+                else:
+                    self.overwrites += 1
+
+            self.keys[i] = key ^ data
+            self.data[i] = data
+
+        # otherwise the shallower result goes in the always-replace slot (or is dropped)
+        elif self.replacement == "two_tier":
+            if self.data[i + 1] & USED:
+                self.overwrites += 1
+            self.keys[i + 1] = key ^ data
+            self.data[i + 1] = data
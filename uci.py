@@ -0,0 +1,235 @@
+# uci front end, runs the ai headless under a gui or tournament manager: python uci.py
+# commands are read on the main thread, searches run on a background thread so stop and isready answer right away
+
+import sys
+import threading
+import ai
+import chess_engine
+from move_encoding import to_uci
+
+ENGINE_NAME = "chess_ai"
+ENGINE_AUTHOR = "ianktc"
+
+MAX_HASH_MB = 4096
+MAX_THREADS = 256
+
+# time kept back from every move for process and gui latency (seconds)
+MOVE_OVERHEAD = 0.05
+
+# moves assumed left in the game when the gui doesn't send movestogo
+MOVES_TO_GO = 30
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# the legal packed move in gs with this uci string, or None
+def find_move(gs, uci):
+    for m in gs.valid_moves_packed():
+        if to_uci(m) == uci:
+            return m
+    return None
+
+# uci score field, mates in moves rather than centipawns
+def format_score(score):
+    if score > ai.MATE_BOUND:
+        return "mate " + str((ai.CHECKMATE - score + 1) // 2)
+    if score < -ai.MATE_BOUND:
+        return "mate -" + str((ai.CHECKMATE + score) // 2)
+    return "cp " + str(score)
+
+# seconds to spend on a move, from the go parameters (None for no time limit)
+def time_budget(params, white_to_move):
+
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+
+    remaining = params.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        return None
+
+    increment = params.get("winc" if white_to_move else "binc", 0)
+    moves_to_go = params.get("movestogo", MOVES_TO_GO) or MOVES_TO_GO
+    budget = remaining / moves_to_go + increment * 3 / 4
+
+    # never plan on more than half of what's left
+    budget = min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD
+    return max(budget, 0.01)
+
+class uci_engine():
+
+    # constructor (output is a function taking one line, print by default)
+    def __init__(self, output = None):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.gs = chess_engine.game_state("bitboard")
+        self.thread = None
+        self.info = None
+        self.infinite = False
+        self.ponder_budget = None
+        self.stop_event = threading.Event()
+
+    def send(self, line):
+        with self.output_lock:
+            if self.output is not None:
+                self.output(line)
+            else:
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+
+    # handle one command line, returns False on quit
+    def command(self, line):
+
+        tokens = line.split()
+        if not tokens:
+            return True
+        name = tokens[0]
+
+        if name == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default " + str(ai.HASH_MB) + " min 1 max " + str(MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max " + str(MAX_THREADS))
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "setoption":
+            self.set_option(tokens[1:])
+        elif name == "ucinewgame":
+            self.stop()
+            ai.set_hash_size(*ai.hash_settings)
+            self.gs = chess_engine.game_state("bitboard")
+        elif name == "position":
+            self.stop()
+            self.set_position(tokens[1:])
+        elif name == "go":
+            self.go(tokens[1:])
+        elif name == "stop":
+            self.stop()
+        elif name == "ponderhit":
+            self.ponder_hit()
+        elif name == "quit":
+            self.stop()
+            return False
+
+        return True
+
+    # setoption name <name> value <value>
+    def set_option(self, tokens):
+
+        if "name" not in tokens:
+            return
+        value_at = tokens.index("value") if "value" in tokens else len(tokens)
+        option = " ".join(tokens[tokens.index("name") + 1:value_at]).lower()
+        value = " ".join(tokens[value_at + 1:])
+
+        self.stop()
+        try:
+            if option == "hash":
+                ai.set_hash_size(min(max(int(value), 1), MAX_HASH_MB), ai.hash_settings[1])
+            elif option == "threads":
+                ai.set_threads(min(max(int(value), 1), MAX_THREADS))
+        except ValueError:
+            self.send("info string bad value for " + option + ": " + value)
+
+    # position [startpos | fen <fen>] [moves <move> ...]
+    def set_position(self, tokens):
+
+        moves_at = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens and tokens[0] == "fen":
+            fen = " ".join(tokens[1:moves_at])
+        else:
+            fen = START_FEN
+
+        try:
+            gs = chess_engine.game_state("bitboard", fen = fen)
+        except ValueError as error:
+            self.send("info string " + str(error))
+            return
+
+        for uci in tokens[moves_at + 1:]:
+            m = find_move(gs, uci)
+            if m is None:
+                self.send("info string illegal move " + uci)
+                break
+            gs.make_packed(m)
+
+        self.gs = gs
+
+    # go [depth n] [movetime ms] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [nodes n] [infinite]
+    def go(self, tokens):
+
+        self.stop()
+
+        params = {}
+        for i, token in enumerate(tokens):
+            if token in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes") and i + 1 < len(tokens):
+                try:
+                    params[token] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+
+        # pondering searches without a limit until ponderhit starts the clock with the budget worked out here
+        self.infinite = "infinite" in tokens or "ponder" in tokens
+        budget = time_budget(params, self.gs.white_to_move)
+        self.ponder_budget = budget if "ponder" in tokens else None
+        time_limit = None if self.infinite else budget
+
+        self.info = ai.search_info()
+        self.info.on_iteration = self.report
+        self.stop_event.clear()
+
+        self.thread = threading.Thread(target = self.search, daemon = True,
+                                       args = (self.gs, params.get("depth", ai.MAX_DEPTH), time_limit,
+                                               params.get("nodes"), self.info))
+        self.thread.start()
+
+    # search thread body
+    def search(self, gs, max_depth, time_limit, max_nodes, info):
+
+        if ai.THREADS > 1:
+            best_move, score, pv = ai.parallel_search(gs, max_depth, time_limit, max_nodes, info)
+        else:
+            best_move, score, pv = ai.search(gs, max_depth, time_limit, max_nodes, info)
+
+        # with infinite (or ponder) the best move may only be sent once the gui says stop
+        if self.infinite:
+            self.stop_event.wait()
+
+        if best_move is None:
+            self.send("bestmove 0000")
+        elif len(pv) > 1:
+            self.send("bestmove " + best_move.get_chess_notation() + " ponder " + pv[1].get_chess_notation())
+        else:
+            self.send("bestmove " + best_move.get_chess_notation())
+
+    # info line after each completed depth
+    def report(self, info):
+        elapsed = info.elapsed()
+        self.send("info depth " + str(info.depth) + " score " + format_score(info.score) + " nodes " + str(info.nodes) +
+                  " nps " + str(info.nps()) + " time " + str(int(elapsed * 1000)) +
+                  " pv " + " ".join(player_move.get_chess_notation() for player_move in info.pv))
+
+    # the opponent played the expected move, the ponder search becomes a normal timed one
+    def ponder_hit(self):
+        if self.thread is not None and self.infinite:
+            self.infinite = False
+            if self.ponder_budget is not None:
+                self.info.ponder_hit(self.ponder_budget)
+            self.stop_event.set()
+
+    # end the running search (it still sends its bestmove) and wait for it
+    def stop(self):
+        if self.thread is not None:
+            self.info.stopped = True
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+def main():
+    engine = uci_engine()
+    for line in sys.stdin:
+        if not engine.command(line):
+            break
+    engine.stop()
+
+if __name__ == "__main__":
+    main()